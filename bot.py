@@ -15,6 +15,7 @@ from pyrogram.enums import ParseMode
 
 # Import our custom configuration
 import config
+from database.database import download_log_flusher, flush_download_log
 
 # --- Unique Startup Banner ---
 ASCII_ART = """
@@ -43,6 +44,7 @@ class Bot(Client):
             api_hash=config.API_HASH,
             bot_token=config.TG_BOT_TOKEN,
             workers=config.TG_BOT_WORKERS,
+            max_concurrent_transmissions=config.MAX_CONCURRENT_TRANSMISSIONS,
             plugins={"root": "plugins"}
         )
         
@@ -52,7 +54,6 @@ class Bot(Client):
         self.uptime: datetime = None
         self.db_channel = None
         self.invitelink = None
-        self.workspace_sessions = {} # For the video processing workspace
 
     async def start(self):
         """
@@ -98,6 +99,9 @@ class Bot(Client):
 
         # --- Start Background Tasks ---
         asyncio.create_task(self.notify_admin_on_restart())
+        from plugins.workspace import workspace_janitor # Imported here; the plugin itself imports Bot
+        asyncio.create_task(workspace_janitor())
+        asyncio.create_task(download_log_flusher())
         
         # FIXED: Removed the emoji from the log message to prevent UnicodeEncodeError on Windows
         self.LOGGER(__name__).info(f"Bot @{self.username} is now online and ready!")
@@ -105,6 +109,7 @@ class Bot(Client):
     async def stop(self, *args):
         """Gracefully stops the bot."""
         self.LOGGER(__name__).info("Bot is stopping...")
+        await flush_download_log()
         await super().stop()
         self.LOGGER(__name__).info("Bot has stopped.")
 
@@ -130,4 +135,3 @@ class Bot(Client):
             
         except Exception as e:
             self.LOGGER(__name__).error(f"Admin restart notification failed: {e}")
-            self.LOGGER(__name__).error(f"Admin restart notification failed: {e}")
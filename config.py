@@ -75,6 +75,8 @@ CHANNEL_ID = get_env_var("CHANNEL_ID", required=True, is_int=True) # ID of the p
 
 DB_URI = get_env_var("DATABASE_URL", required=True)
 DB_NAME = get_env_var("DATABASE_NAME", default="HD_Cinema_Bot")
+DB_MAX_POOL_SIZE = get_env_var("DB_MAX_POOL_SIZE", default=100, is_int=True) # Max pooled MongoDB connections
+DB_MIN_POOL_SIZE = get_env_var("DB_MIN_POOL_SIZE", default=10, is_int=True) # Connections kept warm
 PORT = get_env_var("PORT", default="8080")
 # The base URL of your web redirector (e.g., your Blogger or Render URL)
 REDIRECT_URL = get_env_var("REDIRECT_URL", required=True)
@@ -121,7 +123,10 @@ ADMIN_SEARCH_IN_PM = get_bool_env_var("ADMIN_SEARCH_IN_PM", default=True) # Allo
 # ======================================================================================
 
 # --- Performance ---
-TG_BOT_WORKERS = get_env_var("TG_BOT_WORKERS", default=4, is_int=True)
+TG_BOT_WORKERS = get_env_var("TG_BOT_WORKERS", default=16, is_int=True)
+MAX_CONCURRENT_TRANSMISSIONS = get_env_var("MAX_CONCURRENT_TRANSMISSIONS", default=8, is_int=True) # Parallel MTProto transfers per client
+BROADCAST_CONCURRENCY = get_env_var("BROADCAST_CONCURRENCY", default=8, is_int=True) # Parallel sends per broadcast (capped at MAX_CONCURRENT_TRANSMISSIONS)
+BROADCAST_RATE_LIMIT = get_env_var("BROADCAST_RATE_LIMIT", default=25, is_int=True) # Max broadcast messages per second across all workers
 
 # --- Admin List ---
 # Automatically creates a list of admins from the ADMINS env var and always includes the OWNER_ID.
@@ -136,6 +141,9 @@ for admin_id in raw_admins:
 if OWNER_ID not in ADMINS:
     ADMINS.append(OWNER_ID)
 
+# Frozen copy for O(1) membership checks in handlers. filters.user() still needs the list above.
+ADMINS_SET = frozenset(ADMINS)
+
 # --- Logging Setup ---
 LOG_FILE_NAME = "hd_cinema_bot.log"
 logging.basicConfig(
@@ -7,6 +7,7 @@ This file manages all interactions with the MongoDB database.
 - Provides async functions for all CRUD (Create, Read, Update, Delete) operations.
 """
 
+import asyncio
 import logging
 import sys
 from datetime import datetime, timezone, timedelta
@@ -14,14 +15,27 @@ import pymongo
 from pymongo.errors import ConnectionFailure, OperationFailure
 
 # Import configuration
-from config import DB_URI, DB_NAME
+from config import DB_URI, DB_NAME, DB_MAX_POOL_SIZE, DB_MIN_POOL_SIZE
 
 # Set up a logger for this module
 logger = logging.getLogger(__name__)
 
+# _id of the document in 'stats' holding the running file_index totals
+FILE_STATS_ID = 'file_index'
+# Download events are buffered and written in one bulk insert every interval, or sooner once this many are queued
+DOWNLOAD_LOG_FLUSH_INTERVAL = 2.0
+DOWNLOAD_LOG_FLUSH_SIZE = 500
+_pending_downloads = []
+
 # --- Database Connection and Setup ---
 try:
-    dbclient = pymongo.MongoClient(DB_URI)
+    # A single pooled client is shared by every helper in this module
+    dbclient = pymongo.MongoClient(
+        DB_URI,
+        maxPoolSize=DB_MAX_POOL_SIZE,
+        minPoolSize=DB_MIN_POOL_SIZE,
+        waitQueueTimeoutMS=5000
+    )
     database = dbclient[DB_NAME]
     
     # --- Collections ---
@@ -29,17 +43,23 @@ try:
     analytics_data = database['analytics']
     file_index = database['file_index']
     approved_groups = database['groups']
+    stats_data = database['stats']
 
     # --- Create Indexes for Performance ---
-    if "file_name_text" not in file_index.index_information():
+    # Existing index names are read once per collection rather than once per check
+    file_indexes = file_index.index_information()
+    user_indexes = user_data.index_information()
+    analytics_indexes = analytics_data.index_information()
+
+    if "file_name_text" not in file_indexes:
         file_index.create_index([("file_name", pymongo.TEXT)], name="file_name_text", default_language="english")
         logger.info("Created text index on 'file_index' collection.")
 
-    if "_id_" not in user_data.index_information():
-        user_data.create_index([("_id", pymongo.ASCENDING)], name="_id_")
-        logger.info("Ensured default index on 'users' collection's _id field.")
+    if "banned_id_index" not in user_indexes:
+        user_data.create_index([("banned", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], name="banned_id_index")
+        logger.info("Created compound index on 'users' (banned, _id) for broadcast queries.")
     
-    if "file_unique_id_index" not in file_index.index_information():
+    if "file_unique_id_index" not in file_indexes:
         file_index.create_index(
             [("file_unique_id", pymongo.ASCENDING)],
             name="file_unique_id_index",
@@ -48,6 +68,27 @@ try:
         )
         logger.info("Created unique, sparse index on 'file_unique_id' for duplicate checking.")
 
+    if "timestamp_index" not in analytics_indexes:
+        analytics_data.create_index([("timestamp", pymongo.DESCENDING)], name="timestamp_index")
+        logger.info("Created index on 'analytics' (timestamp) for date-range download queries.")
+
+    if "user_timestamp_file_index" not in analytics_indexes:
+        analytics_data.create_index(
+            [("user_id", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING), ("file_id", pymongo.ASCENDING)],
+            name="user_timestamp_file_index"
+        )
+        logger.info("Created covering index on 'analytics' (user_id, timestamp, file_id) for per-user history.")
+
+    # Seed the running file totals once from the index; add_file_to_index keeps them current
+    if not stats_data.find_one({'_id': FILE_STATS_ID}, {'_id': 1}):
+        totals = next(file_index.aggregate([{'$group': {'_id': None, 'total_files': {'$sum': 1}, 'total_size': {'$sum': '$file_size'}}}]), {})
+        stats_data.update_one(
+            {'_id': FILE_STATS_ID},
+            {'$setOnInsert': {'total_files': totals.get('total_files', 0), 'total_size': totals.get('total_size', 0)}},
+            upsert=True
+        )
+        logger.info("Seeded running file totals in 'stats' collection.")
+
     logger.info(f"Successfully connected to MongoDB database: {DB_NAME}")
 
 except ConnectionFailure as e:
@@ -70,6 +111,13 @@ async def remove_group(group_id: int):
     try: approved_groups.delete_one({'_id': group_id})
     except OperationFailure as e: logger.error(f"DB Error removing group {group_id}: {e}")
 
+async def is_group_approved(group_id: int) -> bool:
+    """Checks a single group's approval with an _id lookup instead of listing every approved group."""
+    try: return approved_groups.find_one({'_id': group_id}, {'_id': 1}) is not None
+    except OperationFailure as e:
+        logger.error(f"DB Error checking group {group_id}: {e}")
+        return False
+
 async def get_approved_groups():
     try: return list(approved_groups.find())
     except OperationFailure as e:
@@ -80,32 +128,61 @@ async def get_approved_groups():
 #                              *** User Management ***
 # ======================================================================================
 
-async def add_user(user_id: int):
-    try: user_data.update_one({'_id': user_id}, {'$set': {'banned': False}, '$setOnInsert': {'joined_date': datetime.now(timezone.utc)}}, upsert=True)
-    except OperationFailure as e: logger.error(f"DB Error adding user {user_id}: {e}")
+async def get_or_add_user(user_id: int):
+    """
+    Registers the user if new and returns their previous record in one round-trip.
+    Returns None for a newly added user, otherwise a document holding only 'banned'.
+    Database errors are re-raised, so a failed lookup is never mistaken for a new (unbanned) user.
+    """
+    try:
+        return user_data.find_one_and_update(
+            {'_id': user_id},
+            {'$setOnInsert': {'banned': False, 'joined_date': datetime.now(timezone.utc)}},
+            projection={'banned': 1},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.BEFORE
+        )
+    except OperationFailure as e:
+        logger.error(f"DB Error registering user {user_id}: {e}")
+        raise
 
-async def get_user(user_id: int):
-    try: return user_data.find_one({'_id': user_id})
+async def get_user(user_id: int, projection: dict = None):
+    try: return user_data.find_one({'_id': user_id}, projection)
     except OperationFailure as e:
         logger.error(f"DB Error getting user {user_id}: {e}")
         return None
 
 async def is_user_present(user_id: int) -> bool:
-    user = await get_user(user_id)
+    user = await get_user(user_id, {'banned': 1})
     return bool(user) and not user.get('banned', False)
 
-async def get_all_users():
-    try: return list(user_data.find())
+async def count_users(include_banned: bool = False) -> int:
+    """Counts users on the server instead of fetching them."""
+    try:
+        total = user_data.estimated_document_count()
+        if include_banned: return total
+        # Banned users are few, so counting them on the (banned, _id) index beats scanning for '$ne'
+        return max(total - user_data.count_documents({'banned': True}), 0)
     except OperationFailure as e:
-        logger.error(f"DB Error getting all users: {e}")
-        return []
+        logger.error(f"DB Error counting users: {e}")
+        return 0
 
-async def get_all_user_ids():
-    try: return [doc['_id'] for doc in user_data.find({'banned': {'$ne': True}}, {'_id': 1})]
+async def get_users_page(skip: int, limit: int):
+    """Returns one page of users (ID and ban status only), ordered by ID."""
+    try: return list(user_data.find({}, {'banned': 1}).sort('_id', pymongo.ASCENDING).skip(skip).limit(limit))
     except OperationFailure as e:
-        logger.error(f"DB Error getting all user IDs: {e}")
+        logger.error(f"DB Error getting users page: {e}")
         return []
 
+async def iter_user_ids(include_banned: bool = False, batch_size: int = 1000):
+    """Yields user IDs straight from a database cursor instead of building a list."""
+    query = {} if include_banned else {'banned': {'$ne': True}}
+    try:
+        for doc in user_data.find(query, {'_id': 1}).batch_size(batch_size):
+            yield doc['_id']
+    except OperationFailure as e:
+        logger.error(f"DB Error iterating user IDs: {e}")
+
 async def ban_user(user_id: int):
     user_data.update_one({'_id': user_id}, {'$set': {'banned': True}}, upsert=True)
 
@@ -116,19 +193,68 @@ async def delete_user(user_id: int):
     try: user_data.delete_one({'_id': user_id})
     except OperationFailure as e: logger.error(f"DB Error deleting user {user_id}: {e}")
 
+async def delete_users(user_ids: list):
+    """Deletes several users in a single unordered bulk write."""
+    if not user_ids: return
+    try: user_data.bulk_write([pymongo.DeleteOne({'_id': user_id}) for user_id in user_ids], ordered=False)
+    except OperationFailure as e: logger.error(f"DB Error bulk deleting {len(user_ids)} users: {e}")
+
 # ======================================================================================
 #                               *** Analytics & Stats ***
 # ======================================================================================
 
+def _file_name_lookup(file_id_field: str) -> dict:
+    """Joins only the file name from file_index, so the rest of each indexed file document never leaves the server."""
+    return {'$lookup': {
+        'from': 'file_index',
+        'let': {'file_id': file_id_field},
+        'pipeline': [{'$match': {'$expr': {'$eq': ['$_id', '$$file_id']}}}, {'$project': {'_id': 0, 'file_name': 1}}],
+        'as': 'file_details'
+    }}
+
 async def log_file_download(file_id: int, user_id: int):
-    try: analytics_data.insert_one({'file_id': file_id, 'user_id': user_id, 'timestamp': datetime.now(timezone.utc)})
-    except OperationFailure as e: logger.error(f"DB Error logging download for file {file_id}: {e}")
+    await log_file_downloads([file_id], user_id)
+
+async def log_file_downloads(file_ids: list, user_id: int):
+    """Queues a download for each file; download_log_flusher writes them in bulk."""
+    if not file_ids: return
+    now = datetime.now(timezone.utc)
+    _pending_downloads.extend({'file_id': file_id, 'user_id': user_id, 'timestamp': now} for file_id in file_ids)
+    if len(_pending_downloads) >= DOWNLOAD_LOG_FLUSH_SIZE:
+        await flush_download_log()
+
+async def flush_download_log():
+    """Writes every queued download to analytics in a single unordered bulk insert."""
+    if not _pending_downloads: return
+    batch = _pending_downloads[:]
+    _pending_downloads.clear()
+    try: analytics_data.insert_many(batch, ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        # Per-document write errors; the rest of the batch was stored, and a duplicate _id
+        # means the event was already written by an earlier attempt
+        failed = [err for err in e.details.get('writeErrors', []) if err.get('code') != 11000]
+        if failed: logger.error(f"DB Error logging downloads: {len(failed)} of {len(batch)} not written.")
+    except Exception as e:
+        # Connection errors (AutoReconnect, server selection timeouts) lose nothing: the batch
+        # keeps its _ids and goes back to the front of the queue for the next flush
+        _pending_downloads[:0] = batch
+        logger.error(f"DB Error logging {len(batch)} downloads, will retry: {e}")
+
+async def download_log_flusher():
+    """Background task that flushes queued downloads every DOWNLOAD_LOG_FLUSH_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(DOWNLOAD_LOG_FLUSH_INTERVAL)
+        try:
+            await flush_download_log()
+        except Exception as e:
+            logger.error(f"Download log flusher error: {e}", exc_info=True)
 
 async def get_daily_download_counts():
     today_utc = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     yesterday_utc = today_utc - timedelta(days=1)
     day_before_utc = today_utc - timedelta(days=2)
-    pipeline = [{'$facet': {'today': [{'$match': {'timestamp': {'$gte': today_utc}}}, {'$count': 'count'}], 'yesterday': [{'$match': {'timestamp': {'$gte': yesterday_utc, '$lt': today_utc}}}, {'$count': 'count'}], 'day_before': [{'$match': {'timestamp': {'$gte': day_before_utc, '$lt': yesterday_utc}}}, {'$count': 'count'}]}}]
+    # Facet branches cannot use indexes, so the indexed match trims the input to the three days first
+    pipeline = [{'$match': {'timestamp': {'$gte': day_before_utc}}}, {'$facet': {'today': [{'$match': {'timestamp': {'$gte': today_utc}}}, {'$count': 'count'}], 'yesterday': [{'$match': {'timestamp': {'$gte': yesterday_utc, '$lt': today_utc}}}, {'$count': 'count'}], 'day_before': [{'$match': {'timestamp': {'$gte': day_before_utc, '$lt': yesterday_utc}}}, {'$count': 'count'}]}}]
     try:
         result = list(analytics_data.aggregate(pipeline))[0]
         today_count = result['today'][0]['count'] if result.get('today') and result['today'] else 0
@@ -143,8 +269,9 @@ async def get_top_downloaded_files(days: int = 0):
     match_filter = {}
     if days > 0:
         match_filter = {'timestamp': {'$gte': datetime.now(timezone.utc) - timedelta(days=days)}}
-    pipeline = [{'$match': match_filter}, {'$group': {'_id': '$file_id', 'count': {'$sum': 1}}}, {'$sort': {'count': -1}}, {'$limit': 5}, {'$lookup': {'from': 'file_index', 'localField': '_id', 'foreignField': '_id', 'as': 'file_details'}}, {'$unwind': '$file_details'}, {'$project': {'count': 1, 'file_name': '$file_details.file_name'}}]
-    try: return list(analytics_data.aggregate(pipeline))
+    pipeline = [{'$match': match_filter}, {'$group': {'_id': '$file_id', 'count': {'$sum': 1}}}, {'$sort': {'count': -1}}, {'$limit': 5}, _file_name_lookup('$_id'), {'$unwind': '$file_details'}, {'$project': {'count': 1, 'file_name': '$file_details.file_name'}}]
+    # An all-time $group spans every download event and may exceed the in-memory stage limit
+    try: return list(analytics_data.aggregate(pipeline, allowDiskUse=True))
     except OperationFailure as e:
         logger.error(f"DB Error getting top files: {e}")
         return []
@@ -156,7 +283,7 @@ async def get_user_download_count(user_id: int):
         return 0
 
 async def get_user_last_downloads(user_id: int, limit: int = 5):
-    pipeline = [ {'$match': {'user_id': user_id}}, {'$sort': {'timestamp': -1}}, {'$limit': limit}, {'$lookup': {'from': 'file_index', 'localField': 'file_id', 'foreignField': '_id', 'as': 'file_details'}}, {'$unwind': '$file_details'}, {'$project': {'file_name': '$file_details.file_name', 'timestamp': 1}} ]
+    pipeline = [ {'$match': {'user_id': user_id}}, {'$sort': {'timestamp': -1}}, {'$limit': limit}, {'$project': {'_id': 0, 'file_id': 1, 'timestamp': 1}}, _file_name_lookup('$file_id'), {'$unwind': '$file_details'}, {'$project': {'file_name': '$file_details.file_name', 'timestamp': 1}} ]
     try: return list(analytics_data.aggregate(pipeline))
     except OperationFailure as e:
         logger.error(f"DB Error getting user last downloads for {user_id}: {e}")
@@ -172,18 +299,12 @@ async def get_db_stats():
         return 0, 0
 
 async def get_total_file_stats():
-    """Gets total number of files and their total size from the index."""
-    pipeline = [
-        {'$group': {
-            '_id': None,
-            'total_files': {'$sum': 1},
-            'total_size': {'$sum': '$file_size'}
-        }}
-    ]
+    """Gets total number of files and their total size from the running totals kept beside the index."""
     try:
-        result = list(file_index.aggregate(pipeline))[0]
+        result = stats_data.find_one({'_id': FILE_STATS_ID}) or {}
         return result.get('total_files', 0), result.get('total_size', 0)
-    except (OperationFailure, IndexError):
+    except OperationFailure as e:
+        logger.error(f"DB Error getting file stats: {e}")
         return 0, 0
 
 # ======================================================================================
@@ -191,8 +312,8 @@ async def get_total_file_stats():
 # ======================================================================================
 
 async def find_file_by_unique_id(file_unique_id: str):
-    """Finds a file in the index by its unique_id."""
-    try: return file_index.find_one({'file_unique_id': file_unique_id})
+    """Finds a file in the index by its unique_id. Only the _id (the DB channel message ID) is returned."""
+    try: return file_index.find_one({'file_unique_id': file_unique_id}, {'_id': 1})
     except OperationFailure as e:
         logger.error(f"DB Error finding file by unique_id: {e}")
         return None
@@ -208,14 +329,16 @@ async def add_file_to_index(message) -> str:
         if existing_file:
             return "duplicate"
 
+        file_size = getattr(media, 'file_size', 0) or 0
         file_index.insert_one({
             '_id': message.id,
             'file_unique_id': file_unique_id,
             'file_name': getattr(media, 'file_name', 'Photo'),
-            'file_size': getattr(media, 'file_size', 0),
+            'file_size': file_size,
             'date_added': message.date,
             'duration': getattr(media, 'duration', 0) or 0
         })
+        stats_data.update_one({'_id': FILE_STATS_ID}, {'$inc': {'total_files': 1, 'total_size': file_size}}, upsert=True)
         return "new"
     except pymongo.errors.DuplicateKeyError:
         return "duplicate"
@@ -225,7 +348,7 @@ async def add_file_to_index(message) -> str:
 
 async def search_files(query: str, limit: int = 15):
     try:
-        return list(file_index.find({'$text': {'$search': query}}, {'score': {'$meta': 'textScore'}}).sort([('score', {'$meta': 'textScore'})]).limit(limit))
+        return list(file_index.find({'$text': {'$search': query}}, {'file_name': 1, 'file_size': 1, 'score': {'$meta': 'textScore'}}).sort([('score', {'$meta': 'textScore'})]).limit(limit))
     except OperationFailure as e:
         logger.error(f"DB Error during file search for query '{query}': {e}")
         return []
@@ -3,32 +3,65 @@ import re
 import asyncio
 import time
 import logging
-import math
+from collections import OrderedDict
 from pyrogram import filters, Client
 from pyrogram.enums import ChatMemberStatus
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
-from pyrogram.errors import FloodWait, MessageNotModified, UserNotParticipant
+from pyrogram.errors import FloodWait, MessageNotModified, UserNotParticipant, UserIsBlocked, InputUserDeactivated
 
 from config import (
     FORCE_SUB_CHANNEL, 
-    ADMINS, 
+    ADMINS_SET,
     AUTO_DELETE_TIME, 
     RE_REQUEST_EXPIRY_HOURS, 
     EXPIRED_MSG,
-    FINAL_EXPIRED_MSG
+    FINAL_EXPIRED_MSG,
+    CUSTOM_CAPTION,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_RATE_LIMIT,
+    MAX_CONCURRENT_TRANSMISSIONS
 )
+from database.database import delete_users
 
 # Set up a logger for this module
 logger = logging.getLogger(__name__)
 
+# Minimum seconds between broadcast progress edits
+BROADCAST_EDIT_INTERVAL = 2.0
+# User IDs buffered between the database cursor and the broadcast workers
+BROADCAST_QUEUE_SIZE = 200
+# Dead users collected before they are removed in one bulk write
+DEAD_USER_FLUSH_SIZE = 500
+# Matches t.me links to a channel post, public or private (/c/)
+MESSAGE_LINK_PATTERN = re.compile(r"https://t.me/(?:c/)?(.+?)/(\d+)")
+
+# Seconds a fetched DB channel post is reused before it is fetched again
+DB_MESSAGE_CACHE_TTL = 600
+# Most DB channel posts kept in memory; the least recently used are evicted first
+DB_MESSAGE_CACHE_SIZE = 1000
+DB_MESSAGE_CACHE = OrderedDict()
+
+SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+
 def format_bytes(size_bytes):
     """Converts bytes to a human-readable format (KB, MB, GB)."""
-    if size_bytes == 0: return "0 B"
-    size_name = ("B", "KB", "MB", "GB", "TB")
-    i = int(math.floor(math.log(size_bytes, 1024)))
-    p = math.pow(1024, i)
-    s = round(size_bytes / p, 2)
-    return f"{s} {size_name[i]}"
+    if not size_bytes or size_bytes < 1: return "0 B"
+    # Each unit is 2**10 of the previous one, so the unit index falls out of the bit length
+    i = min((int(size_bytes).bit_length() - 1) // 10, len(SIZE_UNITS) - 1)
+    return f"{round(size_bytes / (1 << (10 * i)), 2)} {SIZE_UNITS[i]}"
+
+def _custom_file_caption(msg: Message) -> str:
+    media = msg.document or msg.video
+    return CUSTOM_CAPTION.format(
+        filename=media.file_name if media else '',
+        previous_caption=msg.caption.html if msg.caption else ''
+    )
+
+def _original_file_caption(msg: Message) -> str:
+    return msg.caption.html if msg.caption else ''
+
+# Builds the caption a delivered file is sent with; CUSTOM_CAPTION is fixed at startup.
+build_file_caption = _custom_file_caption if CUSTOM_CAPTION else _original_file_caption
 
 async def is_subscribed(filter, client: Client, update: Message):
     """
@@ -39,7 +72,7 @@ async def is_subscribed(filter, client: Client, update: Message):
         return True
     
     user_id = update.from_user.id
-    if user_id in ADMINS:
+    if user_id in ADMINS_SET:
         return True
         
     try:
@@ -72,25 +105,38 @@ async def decode(base64_string: str) -> str:
 
 async def get_messages(client: Client, message_ids) -> list:
     """
-    Fetches messages in batches of 200 from the database channel.
-    Handles FloodWait and logs other errors gracefully.
+    Fetches messages from the database channel, in the order requested.
+    Recently fetched posts are served from DB_MESSAGE_CACHE; the rest are
+    fetched in batches of 200. Handles FloodWait and logs other errors gracefully.
     """
-    messages = []
-    total_messages = 0
-    
     if isinstance(message_ids, range):
         message_ids = list(message_ids)
     elif not isinstance(message_ids, list):
         message_ids = [message_ids]
-        
-    while total_messages != len(message_ids):
-        batch_ids = message_ids[total_messages : total_messages + 200]
+
+    now = time.monotonic()
+    found = {}
+    for msg_id in message_ids:
+        cached = DB_MESSAGE_CACHE.get(msg_id)
+        if cached and now - cached[1] < DB_MESSAGE_CACHE_TTL:
+            DB_MESSAGE_CACHE.move_to_end(msg_id)
+            found[msg_id] = cached[0]
+    missing_ids = [msg_id for msg_id in message_ids if msg_id not in found]
+
+    total_messages = 0
+    while total_messages != len(missing_ids):
+        batch_ids = missing_ids[total_messages : total_messages + 200]
         try:
             msgs = await client.get_messages(
                 chat_id=client.db_channel.id,
                 message_ids=batch_ids
             )
-            messages.extend(msgs)
+            for msg in msgs:
+                found[msg.id] = msg
+                # Deleted posts come back empty and are never cached
+                if not msg.empty:
+                    DB_MESSAGE_CACHE[msg.id] = (msg, now)
+                    DB_MESSAGE_CACHE.move_to_end(msg.id)
         except FloodWait as e:
             logger.warning(f"FloodWait of {e.value} seconds, sleeping...")
             await asyncio.sleep(e.value)
@@ -99,8 +145,11 @@ async def get_messages(client: Client, message_ids) -> list:
             logger.error(f"Error getting messages from DB channel: {e}", exc_info=True)
             
         total_messages += len(batch_ids)
-        
-    return messages
+
+    while len(DB_MESSAGE_CACHE) > DB_MESSAGE_CACHE_SIZE:
+        DB_MESSAGE_CACHE.popitem(last=False)
+
+    return [found[msg_id] for msg_id in message_ids if msg_id in found]
 
 
 async def get_message_id(client: Client, message: Message) -> int:
@@ -112,8 +161,7 @@ async def get_message_id(client: Client, message: Message) -> int:
         if message.forward_from_chat.id == client.db_channel.id:
             return message.forward_from_message_id
     elif message.text:
-        pattern = r"https://t.me/(?:c/)?(.+?)/(\d+)"
-        match = re.match(pattern, message.text)
+        match = MESSAGE_LINK_PATTERN.match(message.text)
         if match:
             channel_identifier = match.group(1)
             msg_id = int(match.group(2))
@@ -185,4 +233,98 @@ async def handle_file_expiry(client: Client, timer_message: Message, file_to_del
         except Exception as final_e:
             logger.error(f"Failed to edit final expiry message for {timer_message.id}: {final_e}")
 
+async def broadcast_message(broadcast_msg: Message, user_ids, status_msg: Message = None, progress_text: str = None) -> dict:
+    """
+    Copies a message to every user yielded by the async iterable user_ids.
+    IDs are fed through a bounded queue to a fixed pool of send workers, so
+    sending starts with the first database batch and the userbase is never held in memory.
+    Blocked and deactivated users are removed from the database in bulk batches.
+    If given, status_msg is edited with progress_text (formatted with the counts)
+    at most once every BROADCAST_EDIT_INTERVAL seconds.
+    Returns the final counts, including the total number of users queued.
+    """
+    counts = {'total': 0, 'successful': 0, 'blocked': 0, 'deleted': 0, 'unsuccessful': 0}
+    queue = asyncio.Queue(maxsize=BROADCAST_QUEUE_SIZE)
+    worker_count = min(BROADCAST_CONCURRENCY, MAX_CONCURRENT_TRANSMISSIONS)
+    dead_ids = []
+    last_edit = time.monotonic()
+    # Shared pacing for all workers: sends are spaced to BROADCAST_RATE_LIMIT per second,
+    # and a FloodWait on any worker pushes the next slot back for every worker.
+    send_interval = 1 / BROADCAST_RATE_LIMIT if BROADCAST_RATE_LIMIT > 0 else 0
+    next_send = 0.0
+
+    async def wait_for_slot():
+        nonlocal next_send
+        now = time.monotonic()
+        slot = max(now, next_send)
+        next_send = slot + send_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def send(user_id: int) -> str:
+        nonlocal next_send
+        await wait_for_slot()
+        try:
+            await broadcast_msg.copy(user_id)
+        except FloodWait as e:
+            logger.warning(f"FloodWait of {e.value}s during broadcast, pausing all workers.")
+            next_send = max(next_send, time.monotonic() + e.value)
+            await wait_for_slot()
+            await broadcast_msg.copy(user_id)
+        return 'successful'
+
+    async def deliver(user_id: int):
+        nonlocal last_edit
+        try:
+            outcome = await send(user_id)
+        except UserIsBlocked:
+            dead_ids.append(user_id)
+            outcome = 'blocked'
+        except InputUserDeactivated:
+            dead_ids.append(user_id)
+            outcome = 'deleted'
+        except Exception as e:
+            logger.error(f"Failed to broadcast to {user_id}. Error: {e}")
+            outcome = 'unsuccessful'
+        counts[outcome] += 1
+
+        if len(dead_ids) >= DEAD_USER_FLUSH_SIZE:
+            batch = dead_ids[:]
+            dead_ids.clear()
+            await delete_users(batch)
+
+        now = time.monotonic()
+        if status_msg and progress_text and now - last_edit >= BROADCAST_EDIT_INTERVAL:
+            last_edit = now
+            try:
+                await status_msg.edit(progress_text.format(**counts))
+            except (MessageNotModified, FloodWait):
+                pass
+            except Exception as e:
+                logger.warning(f"Could not update broadcast progress: {e}")
+
+    async def worker():
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            # An unexpected error (e.g. a failed dead-user flush) must not end the worker,
+            # or the producer would block forever on the full queue once every worker is gone.
+            try:
+                await deliver(user_id)
+            except Exception as e:
+                logger.error(f"Broadcast worker error for user {user_id}: {e}", exc_info=True)
+
+    workers = [asyncio.create_task(worker()) for _ in range(worker_count)]
+    try:
+        async for user_id in user_ids:
+            counts['total'] += 1
+            await queue.put(user_id)
+    finally:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        await delete_users(dead_ids)
+    return counts
+
 subscribed = filters.create(is_subscribed)
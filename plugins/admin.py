@@ -13,10 +13,11 @@ import math
 import logging
 import psutil
 import asyncio
+import time
 from datetime import datetime
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from pyrogram.errors import MessageNotModified, FloodWait, UserIsBlocked, InputUserDeactivated
+from pyrogram.errors import MessageNotModified
 from pyrogram.handlers import MessageHandler
 from pyrogram import filters
 
@@ -24,37 +25,39 @@ from bot import Bot
 from config import ADMINS, TEMP_DIR, ADMIN_SEARCH_IN_PM
 import config as config_module # Import the module itself to modify the variable
 from database.database import (
-    get_all_user_ids, get_all_users, ban_user, unban_user, get_user,
+    count_users, get_users_page, iter_user_ids, ban_user, unban_user, get_user,
     get_daily_download_counts, get_top_downloaded_files, get_total_file_stats,
     get_db_stats, get_user_download_count, get_user_last_downloads,
-    add_group, remove_group, get_approved_groups, delete_user,
+    add_group, remove_group, get_approved_groups,
     get_setting, set_setting  # <-- Add these
 )
-from helper_func import get_readable_time
+from helper_func import get_readable_time, format_bytes, broadcast_message
 
 # --- Setup ---
 logger = logging.getLogger(__name__)
 USERS_PER_PAGE = 10
+# Seconds an analytics aggregation result is reused across panel views
+ANALYTICS_CACHE_TTL = 60
+ANALYTICS_CACHE = {}
+
+
+async def cached_analytics(key, fetch, *args, **kwargs):
+    """Returns the cached result for key, re-running the fetch coroutine once it is older than ANALYTICS_CACHE_TTL."""
+    cached = ANALYTICS_CACHE.get(key)
+    if cached and time.monotonic() - cached['timestamp'] < ANALYTICS_CACHE_TTL:
+        return cached['result']
+    result = await fetch(*args, **kwargs)
+    ANALYTICS_CACHE[key] = {'result': result, 'timestamp': time.monotonic()}
+    return result
 
 
 # ======================================================================================
 # --- UI Builder Functions ---
 # ======================================================================================
 
-def format_bytes(size_bytes):
-    if size_bytes == 0: return "0 B"
-    size_name = ("B", "KB", "MB", "GB", "TB")
-    try:
-        i = int(math.floor(math.log(size_bytes, 1024)))
-        p = math.pow(1024, i)
-        s = round(size_bytes / p, 2)
-        return f"{s} {size_name[i]}"
-    except ValueError:
-        return "0 B"
-
 async def build_main_menu(client: Client):
     """Builds the main admin dashboard with live stats and integrated command buttons."""
-    total_users = len(await get_all_user_ids())
+    total_users = await count_users()
     total_files, total_size = await get_total_file_stats()
 
     text = (
@@ -107,7 +110,7 @@ async def admin_callback_handler(client: Bot, query: CallbackQuery):
     """The main router for all admin panel button presses."""
     try:
         await query.answer()
-    except:
+    except Exception:
         pass
 
     data = query.data.split("_")
@@ -162,7 +165,7 @@ async def admin_callback_handler(client: Bot, query: CallbackQuery):
 # ======================================================================================
 
 async def show_analytics_menu(query: CallbackQuery):
-    today, yesterday, day_before = await get_daily_download_counts()
+    today, yesterday, day_before = await cached_analytics('daily', get_daily_download_counts)
     text = (
         f"📈 <b>Bot Analytics</b>\n\n"
         f"<b>Daily File Downloads:</b>\n"
@@ -183,7 +186,7 @@ async def show_analytics_menu(query: CallbackQuery):
 
 async def show_top_files(query: CallbackQuery, days: int):
     time_range_text = {0: "All Time", 1: "Today", 7: "This Week", 30: "This Month"}.get(days, f"{days} Days")
-    top_files = await get_top_downloaded_files(days=days)
+    top_files = await cached_analytics(('top', days), get_top_downloaded_files, days=days)
     text = f"🏆 <b>Top 5 Trending Files ({time_range_text})</b>\n\n"
     if not top_files:
         text += "<code>No download data available for this period.</code>"
@@ -199,13 +202,12 @@ async def show_top_files(query: CallbackQuery, days: int):
 # ======================================================================================
 
 async def show_users_list(client: Client, query: CallbackQuery, page: int):
-    users_data = await get_all_users()
-    total_users = len(users_data)
+    total_users = await count_users(include_banned=True)
     total_pages = math.ceil(total_users / USERS_PER_PAGE) if total_users > 0 else 1
     page = max(1, min(page, total_pages))
     
     start_index = (page - 1) * USERS_PER_PAGE
-    users_to_display = users_data[start_index : start_index + USERS_PER_PAGE]
+    users_to_display = await get_users_page(start_index, USERS_PER_PAGE)
     
     tg_users_dict = {u.id: u for u in await client.get_users([u['_id'] for u in users_to_display])}
 
@@ -325,35 +327,19 @@ async def handle_broadcast(client: Client, query: CallbackQuery):
     
     await ask_msg.delete()
     
-    total_users = await get_all_user_ids()
-    pls_wait = await client.send_message(query.from_user.id, f"<i>Broadcasting to {len(total_users)} users...</i>")
+    pls_wait = await client.send_message(query.from_user.id, "<i>Broadcasting message...</i>")
     
-    successful, blocked, unsuccessful = 0, 0, 0
-    for user_id in total_users:
-        try:
-            await response.copy(user_id)
-            successful += 1
-        except (UserIsBlocked, InputUserDeactivated):
-            await delete_user(user_id)
-            blocked += 1
-        except FloodWait as e:
-            await asyncio.sleep(e.value)
-            await response.copy(user_id)
-            successful += 1
-        except Exception:
-            unsuccessful += 1
-        
-        if (successful + blocked + unsuccessful) % 20 == 0:
-            new_text = f"<i>Sent: {successful} | Blocked: {blocked} | Failed: {unsuccessful}</i>"
-            if pls_wait.text != new_text:
-                 await pls_wait.edit(new_text)
+    counts = await broadcast_message(
+        response, iter_user_ids(), status_msg=pls_wait,
+        progress_text="<i>Sent: {successful} | Blocked: {blocked} | Deleted: {deleted} | Failed: {unsuccessful}</i>"
+    )
     
     status = (
         f"<b><u>Broadcast Completed</u></b>\n"
-        f"<b>Total Users:</b> <code>{len(total_users)}</code>\n"
-        f"<b>✅ Successful:</b> <code>{successful}</code>\n"
-        f"<b>🚫 Blocked/Deleted:</b> <code>{blocked}</code>\n"
-        f"<b>❌ Failed:</b> <code>{unsuccessful}</code>"
+        f"<b>Total Users:</b> <code>{counts['total']}</code>\n"
+        f"<b>✅ Successful:</b> <code>{counts['successful']}</code>\n"
+        f"<b>🚫 Blocked/Deleted:</b> <code>{counts['blocked'] + counts['deleted']}</code>\n"
+        f"<b>❌ Failed:</b> <code>{counts['unsuccessful']}</code>"
     )
     await pls_wait.edit(status)
 
@@ -388,7 +374,7 @@ async def handle_disapprove_group(client: Client, query: CallbackQuery, group_id
     await remove_group(group_id)
     await query.answer("Group disapproved and removed.", show_alert=True)
     try: await client.leave_chat(group_id)
-    except: pass
+    except Exception: pass
     await show_groups_list(client, query)
 
 
@@ -452,7 +438,7 @@ async def handle_delete_temp_file(query: CallbackQuery, file_name: str):
         count = 0
         for f in os.listdir(TEMP_DIR):
             try: os.remove(os.path.join(TEMP_DIR, f)); count += 1
-            except: pass
+            except OSError: pass
         await query.answer(f"All {count} temporary files deleted.", show_alert=True)
     else:
         try:
@@ -13,23 +13,33 @@ from pyrogram.enums import ParseMode
 from pyrogram.errors import MessageNotModified
 
 from bot import Bot
-from config import ADMINS, START_MSG, START_PIC
+from config import ADMINS_SET, START_MSG, START_PIC
 from database.database import get_user_download_count
 
 # --- FIX: Import the function to build the admin panel menu ---
 from plugins.admin import build_main_menu
+from plugins.start import QUOTES
 
 # Set up a logger for this module
 logger = logging.getLogger(__name__)
 
-# --- Inspirational Quotes for the Start Message ---
-QUOTES = [
-    "The secret of getting ahead is getting started.",
-    "All our dreams can come true, if we have the courage to pursue them.",
-    "The best way to predict the future is to create it.",
-    "Your limitation is only your imagination.",
-    "Push yourself, because no one else is going to do it for you."
+# --- Main Menu Keyboards (static, so they are built once at import) ---
+# --- FIX: Removed the "Request Content" button ---
+MENU_ROWS = [
+    [
+        InlineKeyboardButton("❓ Help & About", callback_data="help_info"),
+        InlineKeyboardButton("📊 My Stats", callback_data="my_stats")
+    ],
+    [
+        InlineKeyboardButton("💬 Support", url="https://t.me/YourSupportGroup"),
+        InlineKeyboardButton("📣 Updates", url="https://t.me/YourUpdatesChannel")
+    ]
 ]
+MENU_MARKUP = InlineKeyboardMarkup(MENU_ROWS)
+ADMIN_MENU_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("👑 Admin Panel", callback_data="admin_action_refresh")]] + MENU_ROWS
+)
+BACK_TO_MENU_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back to Main Menu", callback_data="start_menu")]])
 
 # --- FIX: Updated regex to include the admin_main_menu callback ---
 @Bot.on_callback_query(filters.regex("^(start_menu|help_info|my_stats|admin_main_menu)$"))
@@ -58,9 +68,7 @@ async def main_menu_callback_handler(client: Bot, query: CallbackQuery):
                 "📌 You are responsible for how you use the provided links/files.\n\n"
                 "<b>Contact Admin:</b> @FilmySpotSupport_bot"
             ),
-            reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("⬅️ Back to Main Menu", callback_data="start_menu")]]
-            )
+            reply_markup=BACK_TO_MENU_MARKUP
         )
 
     # --- "My Stats" Page ---
@@ -72,31 +80,14 @@ async def main_menu_callback_handler(client: Bot, query: CallbackQuery):
                  f"Hello {user.mention}!\n\n"
                  f"You have downloaded a total of <b>{download_count}</b> files from me.\n\n"
                  "Keep exploring!",
-            reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("⬅️ Back to Main Menu", callback_data="start_menu")]]
-            )
+            reply_markup=BACK_TO_MENU_MARKUP
         )
 
     # --- "Back to Main Menu" Action ---
     elif action == "start_menu":
         await query.answer()
         
-        # --- FIX: Removed the "Request Content" button ---
-        keyboard = [
-            [
-                InlineKeyboardButton("❓ Help & About", callback_data="help_info"),
-                InlineKeyboardButton("📊 My Stats", callback_data="my_stats")
-            ],
-            [
-                InlineKeyboardButton("💬 Support", url="https://t.me/YourSupportGroup"),
-                InlineKeyboardButton("📣 Updates", url="https://t.me/YourUpdatesChannel")
-            ]
-        ]
-        if user.id in ADMINS:
-            # The button is still added here, but now the handler will catch it.
-            keyboard.insert(0, [InlineKeyboardButton("👑 Admin Panel", callback_data="admin_action_refresh")])
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = ADMIN_MENU_MARKUP if user.id in ADMINS_SET else MENU_MARKUP
         
         start_text = (
             f"👋 Hello {user.mention}!\n\n"
@@ -118,7 +109,7 @@ async def main_menu_callback_handler(client: Bot, query: CallbackQuery):
 
     # --- FIX: New handler for the Admin Panel button ---
     elif action == "admin_main_menu":
-        if user.id not in ADMINS:
+        if user.id not in ADMINS_SET:
             return await query.answer("This is an admin-only area.", show_alert=True)
         
         await query.answer()
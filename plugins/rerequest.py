@@ -15,10 +15,10 @@ from pyrogram.errors import MessageNotModified
 
 from bot import Bot
 from config import (
-    CUSTOM_CAPTION, DISABLE_CHANNEL_BUTTON, PROTECT_CONTENT,
+    DISABLE_CHANNEL_BUTTON, PROTECT_CONTENT,
     AUTO_DELETE_TIME, FINAL_EXPIRED_MSG
 )
-from helper_func import get_messages, handle_file_expiry, get_readable_time
+from helper_func import get_messages, handle_file_expiry, get_readable_time, build_file_caption
 
 # Set up a logger for this module
 logger = logging.getLogger(__name__)
@@ -58,10 +58,7 @@ async def rerequest_callback_handler(client: Client, query: CallbackQuery):
         user_id = query.from_user.id
 
         # --- Re-send the file ---
-        caption = CUSTOM_CAPTION.format(
-            filename=getattr(msg.document or msg.video, 'file_name', ''),
-            previous_caption=getattr(msg.caption, 'html', '')
-        ) if CUSTOM_CAPTION else getattr(msg.caption, 'html', '')
+        caption = build_file_caption(msg)
         
         reply_markup = msg.reply_markup if not DISABLE_CHANNEL_BUTTON else None
 
@@ -11,6 +11,7 @@ import logging
 import math
 import time
 import hashlib
+from functools import lru_cache
 from urllib.parse import quote_plus
 from pyrogram import Client, filters
 from pyrogram.enums import ChatType, ChatMemberStatus
@@ -19,9 +20,9 @@ from pyrogram.errors import UserNotParticipant, UserIsBlocked
 
 from bot import Bot
 # --- MODIFICATION: Import new config variable ---
-from config import ADMINS, GROUP_SEARCH_PIC
+from config import ADMINS_SET, GROUP_SEARCH_PIC
 import config as config_module  # <-- Add this line
-from database.database import search_files, get_approved_groups, get_setting
+from database.database import search_files, is_group_approved, get_setting
 from helper_func import encode, format_bytes
 
 logger = logging.getLogger(__name__)
@@ -33,14 +34,18 @@ MIN_QUERY_LENGTH = 3
 # --- In-memory cache to store search results and solve the ButtonDataInvalid error ---
 SEARCH_RESULTS_CACHE = {}
 
+@lru_cache(maxsize=4096)
+def get_query_hash(query: str) -> str:
+    """Returns the short, memoized cache key used for a search query."""
+    return hashlib.md5(query.encode()).hexdigest()[:10]
+
 # ============================================================================
 # Group approval check (bot must be admin and group must be approved)
 # ============================================================================
 
 async def is_approved_admin_group(_, client: Bot, message: Message):
     """Checks if the message is from a group where the bot is an approved admin."""
-    approved_group_ids = [group['_id'] for group in await get_approved_groups()]
-    if message.chat.id not in approved_group_ids:
+    if not await is_group_approved(message.chat.id):
         return False
     try:
         me = await client.get_chat_member(message.chat.id, client.me.id)
@@ -62,7 +67,7 @@ async def universal_search_handler(client: Bot, message: Message):
     # Only block admin file search in PM if disabled, but do not handle any user search prompt logic here
     if (
         not await get_setting("ADMIN_SEARCH_IN_PM", default=True)
-        and message.from_user.id in ADMINS
+        and message.from_user.id in ADMINS_SET
         and message.chat.type == ChatType.PRIVATE
     ):
         return await message.reply_text("ℹ️ Admin search in PM is currently disabled by the bot owner.")
@@ -72,7 +77,7 @@ async def universal_search_handler(client: Bot, message: Message):
         return
 
     # Generate a short, unique hash for the search query to use as a cache key
-    query_hash = hashlib.md5(query.encode()).hexdigest()[:10]
+    query_hash = get_query_hash(query)
     
     # Check cache first to avoid unnecessary database calls
     cached = SEARCH_RESULTS_CACHE.get(query_hash)
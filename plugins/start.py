@@ -9,29 +9,32 @@ This plugin handles the /start command with a robust security model.
 """
 
 import asyncio
-import hashlib
 import logging
 import random
+import time
+from functools import lru_cache
+from itertools import groupby
 from urllib.parse import unquote_plus
 from pyrogram import Client, filters
 from pyrogram.enums import ParseMode
-from pyrogram.errors import FloodWait, UserIsBlocked, InputUserDeactivated, MessageNotModified
+from pyrogram.errors import FloodWait, UserIsBlocked, InputUserDeactivated
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 
 from bot import Bot
 from config import (
-    ADMINS, FORCE_MSG, START_MSG, CUSTOM_CAPTION, DISABLE_CHANNEL_BUTTON,
+    ADMINS, ADMINS_SET, FORCE_MSG, START_MSG, DISABLE_CHANNEL_BUTTON,
     PROTECT_CONTENT, START_PIC, AUTO_DELETE_TIME, JOIN_REQUEST_ENABLE,
     FORCE_SUB_CHANNEL
 )
-from helper_func import subscribed, decode, get_messages, handle_file_expiry, get_readable_time
-# --- FIX: Import get_user in addition to other functions ---
-from database.database import add_user, get_user, delete_user, get_all_user_ids, log_file_download, search_files
-from plugins.search import send_search_results
+from helper_func import subscribed, decode, get_messages, handle_file_expiry, get_readable_time, build_file_caption, broadcast_message
+from database.database import get_user, get_or_add_user, iter_user_ids, log_file_download, log_file_downloads, search_files
+from plugins.search import send_search_results, get_query_hash
 
 # Set up a logger for this module
 logger = logging.getLogger(__name__)
 
+BANNED_TEXT = "<b>Access Denied</b> ❌\n\nYou are banned from using this bot. Please contact the admin if you believe this is a mistake."
+
 # --- Inspirational Quotes for the Start Message ---
 QUOTES = [
     "The secret of getting ahead is getting started.",
@@ -41,6 +44,21 @@ QUOTES = [
     "Push yourself, because no one else is going to do it for you."
 ]
 
+# --- Welcome Keyboards (static, so they are built once at import) ---
+WELCOME_ROWS = [
+    [
+        InlineKeyboardButton("⚠️ Disclaimer", callback_data="help_info"),
+        InlineKeyboardButton("📊 My Stats", callback_data="my_stats")
+    ],
+    [
+        InlineKeyboardButton("💬 Support", url="https://t.me/YourSupportGroup"),
+        InlineKeyboardButton("📣 Updates", url="https://t.me/YourUpdatesChannel")
+    ]
+]
+WELCOME_MARKUP = InlineKeyboardMarkup(WELCOME_ROWS)
+ADMIN_WELCOME_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("👑 Admin Panel", callback_data="admin_action_refresh")]] + WELCOME_ROWS
+)
 
 # ======================================================================================
 #                              *** Core /start Logic with Security Fix ***
@@ -52,26 +70,28 @@ async def start_command(client: Bot, message: Message):
     Handles the /start command with a strict ban check.
     1. Checks if the user is banned.
     2. Checks for force subscription.
-    3. Processes deep links or shows the welcome menu.
+    3. Registers new users.
+    4. Processes deep links or shows the welcome menu.
     """
     user = message.from_user
     
     # --- 1. CRITICAL SECURITY FIX: Check for ban first ---
-    db_user = await get_user(user.id)
+    db_user = await get_user(user.id, {'banned': 1})
     if db_user and db_user.get("banned", False):
-        await message.reply_text(
-            "<b>Access Denied</b> ❌\n\nYou are banned from using this bot. Please contact the admin if you believe this is a mistake."
-        )
-        return
+        return await message.reply_text(BANNED_TEXT)
 
     # --- 2. If not banned, check force subscription ---
     if not await subscribed(client, message):
         return await force_sub_handler(client, message)
 
-    # --- 3. If not banned and subscribed, add the user if they are new ---
+    # --- 3. Only subscribed users are registered ---
+    # The upsert returns any record the first lookup missed, so its ban status is checked again.
     if not db_user:
-        await add_user(user.id)
-        logger.info(f"New user added: {user.id}")
+        db_user = await get_or_add_user(user.id)
+        if db_user is None:
+            logger.info(f"New user added: {user.id}")
+        elif db_user.get("banned", False):
+            return await message.reply_text(BANNED_TEXT)
 
     # --- 4. Process deep link or show welcome message ---
     if len(message.command) > 1:
@@ -87,7 +107,7 @@ async def start_command(client: Bot, message: Message):
 
             if unique_results:
                 # --- FIX: Generate query_hash for deep-link search ---
-                query_hash = hashlib.md5(query.encode()).hexdigest()[:10]
+                query_hash = get_query_hash(query)
                 await send_search_results(message, query, query_hash, unique_results, page=1)
             else:
                 await message.reply_text(f"❌ No results found for '<code>{query}</code>'.")
@@ -98,12 +118,13 @@ async def start_command(client: Bot, message: Message):
             try:
                 string = await decode(payload)
                 args = string.split("-")
+                channel_abs = abs(client.db_channel.id)
                 
                 if len(args) == 3: # Batch link
-                    start, end = int(int(args[1]) / abs(client.db_channel.id)), int(int(args[2]) / abs(client.db_channel.id))
+                    start, end = int(args[1]) // channel_abs, int(args[2]) // channel_abs
                     ids = range(start, end + 1)
                 elif len(args) == 2: # Single file link
-                    ids = [int(int(args[1]) / abs(client.db_channel.id))]
+                    ids = [int(args[1]) // channel_abs]
                 else:
                     return await send_welcome_message(client, message)
 
@@ -113,29 +134,14 @@ async def start_command(client: Bot, message: Message):
                 await message.reply_text("<b>Error:</b> The link seems to be invalid or expired.")
             return
 
-    # --- 5. No Payload: Show Welcome Message ---
+    # --- 4. No Payload: Show Welcome Message ---
     await send_welcome_message(client, message)
 
 
 async def send_welcome_message(client: Bot, message: Message):
     """Displays a professional and feature-rich welcome message."""
     user = message.from_user
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("⚠️ Disclaimer", callback_data="help_info"),
-            InlineKeyboardButton("📊 My Stats", callback_data="my_stats")
-        ],
-        [
-            InlineKeyboardButton("💬 Support", url="https://t.me/YourSupportGroup"),
-            InlineKeyboardButton("📣 Updates", url="https://t.me/YourUpdatesChannel")
-        ]
-    ]
-
-    if user.id in ADMINS:
-        keyboard.insert(0, [InlineKeyboardButton("👑 Admin Panel", callback_data="admin_action_refresh")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = ADMIN_WELCOME_MARKUP if user.id in ADMINS_SET else WELCOME_MARKUP
     
     start_text = (
         f"👋 Hello {user.mention}!\n\n"
@@ -166,77 +172,170 @@ async def process_file_request(client: Bot, message: Message, ids: list):
         
     await temp_msg.delete()
 
-    for msg in messages:
-        await log_file_download(file_id=msg.id, user_id=user_id)
-        
-        caption = CUSTOM_CAPTION.format(
-            filename=getattr(msg.document or msg.video, 'file_name', ''),
-            previous_caption=getattr(msg.caption, 'html', '')
-        ) if CUSTOM_CAPTION else getattr(msg.caption, 'html', '')
+    # Consecutive files sharing a media_group_id are albums and can be copied in one call.
+    # copy_media_group has no protect_content option, so protected bots keep the per-file path.
+    # Files are sent one after another so they land in the chat in link order.
+    fetched = {msg.id: msg for msg in messages}
+    for media_group_id, group in groupby(messages, key=lambda m: m.media_group_id):
+        group = list(group)
+        if media_group_id and len(group) > 1 and not PROTECT_CONTENT and await is_whole_album(client, group, fetched):
+            if not await send_album(client, group, user_id):
+                return
+        else:
+            for msg in group:
+                if not await send_single_file(client, msg, user_id):
+                    return
+
 
+async def is_whole_album(client: Bot, group: list, fetched: dict) -> bool:
+    """
+    Checks that group is the complete channel album, in order. copy_media_group copies
+    every post of the album, so a link range that starts or ends mid-album must not use it.
+    """
+    ids = [msg.id for msg in group]
+    media_group_id = group[0].media_group_id
+    # Album posts have consecutive IDs, so fetched neighbours outside the album mean it is complete
+    before, after = fetched.get(ids[0] - 1), fetched.get(ids[-1] + 1)
+    if (
+        ids == list(range(ids[0], ids[-1] + 1))
+        and before and before.media_group_id != media_group_id
+        and after and after.media_group_id != media_group_id
+    ):
+        return True
+    try:
+        album = await client.get_media_group(client.db_channel.id, ids[0])
+    except Exception as e:
+        logger.warning(f"Could not check album {media_group_id}, sending its files one by one. Error: {e}")
+        return False
+    return sorted(msg.id for msg in album) == ids
+
+
+async def send_single_file(client: Bot, msg: Message, user_id: int) -> bool:
+    """Copies one file to the user. Returns False if the user can no longer be reached."""
+    await log_file_download(file_id=msg.id, user_id=user_id)
+    caption = build_file_caption(msg)
+
+    copy_kwargs = dict(
+        chat_id=user_id,
+        caption=caption,
+        parse_mode=ParseMode.HTML,
+        reply_markup=msg.reply_markup if not DISABLE_CHANNEL_BUTTON else None,
+        protect_content=PROTECT_CONTENT
+    )
+
+    try:
         try:
-            sent_message = await msg.copy(
-                chat_id=user_id,
-                caption=caption,
-                parse_mode=ParseMode.HTML,
-                reply_markup=msg.reply_markup if not DISABLE_CHANNEL_BUTTON else None,
-                protect_content=PROTECT_CONTENT
-            )
-            if AUTO_DELETE_TIME > 0:
-                # Inform the user about file expiry and re-request instructions
-                expiry_text = (
-                    f"⏳ <b>This file will be deleted in: {get_readable_time(AUTO_DELETE_TIME)}</b>\n\n"
-                    "You can forward or save this file elsewhere before it expires.\n"
-                    "After expiry, you can request this file <b>one more time</b> using the same link."
-                )
-                expiry_msg = await sent_message.reply_text(expiry_text, quote=True)
-                asyncio.create_task(handle_file_expiry(
-                    client,
-                    expiry_msg,
-                    sent_message,
-                    msg.id
-                ))
-            await asyncio.sleep(0.5)
+            sent_message = await msg.copy(**copy_kwargs)
         except FloodWait as e:
             logger.warning(f"FloodWait for {e.value}s for user {user_id}. Retrying...")
             await asyncio.sleep(e.value)
-            await sent_message.copy(chat_id=user_id, caption=caption, reply_markup=msg.reply_markup, protect_content=PROTECT_CONTENT)
-        except (UserIsBlocked, InputUserDeactivated):
-            logger.warning(f"User {user_id} has blocked the bot or deleted their account.")
-            break
-        except Exception as e:
-            logger.error(f"Failed to send file {msg.id} to user {user_id}. Error: {e}")
+            sent_message = await msg.copy(**copy_kwargs)
+        if AUTO_DELETE_TIME > 0:
+            # Post the expiry notice in the background so the next file isn't held up
+            asyncio.create_task(_post_expiry_notice(client, sent_message, msg.id))
+    except (UserIsBlocked, InputUserDeactivated):
+        logger.warning(f"User {user_id} has blocked the bot or deleted their account.")
+        return False
+    except Exception as e:
+        logger.error(f"Failed to send file {msg.id} to user {user_id}. Error: {e}")
+    return True
+
+
+async def send_album(client: Bot, group: list, user_id: int) -> bool:
+    """
+    Copies a whole media group to the user in a single call; group must be the complete album (see is_whole_album).
+    Returns False if the user can no longer be reached.
+    """
+    await log_file_downloads(file_ids=[msg.id for msg in group], user_id=user_id)
+    captions = [build_file_caption(msg) for msg in group]
+
+    copy_kwargs = dict(
+        chat_id=user_id,
+        from_chat_id=client.db_channel.id,
+        message_id=group[0].id,
+        captions=captions
+    )
+
+    try:
+        try:
+            sent_messages = await client.copy_media_group(**copy_kwargs)
+        except FloodWait as e:
+            logger.warning(f"FloodWait for {e.value}s for user {user_id}. Retrying album...")
+            await asyncio.sleep(e.value)
+            sent_messages = await client.copy_media_group(**copy_kwargs)
+    except (UserIsBlocked, InputUserDeactivated):
+        logger.warning(f"User {user_id} has blocked the bot or deleted their account.")
+        return False
+    except Exception as e:
+        logger.error(f"Failed to send album {group[0].media_group_id} to user {user_id}. Error: {e}")
+        return True
+
+    if AUTO_DELETE_TIME > 0:
+        for sent_message, msg in zip(sent_messages, group):
+            asyncio.create_task(_post_expiry_notice(client, sent_message, msg.id))
+    return True
+
+
+async def _post_expiry_notice(client: Bot, sent_message: Message, db_message_id: int):
+    """Replies with the expiry notice for a delivered file and starts its countdown."""
+    # Inform the user about file expiry and re-request instructions
+    expiry_text = (
+        f"⏳ <b>This file will be deleted in: {get_readable_time(AUTO_DELETE_TIME)}</b>\n\n"
+        "You can forward or save this file elsewhere before it expires.\n"
+        "After expiry, you can request this file <b>one more time</b> using the same link."
+    )
+    delivered_at = time.monotonic()
+    try:
+        try:
+            expiry_msg = await sent_message.reply_text(expiry_text, quote=True)
+        except FloodWait as e:
+            logger.warning(f"FloodWait for {e.value}s posting expiry notice for file {db_message_id}. Retrying...")
+            await asyncio.sleep(e.value)
+            expiry_msg = await sent_message.reply_text(expiry_text, quote=True)
+    except Exception as e:
+        logger.error(f"Could not post expiry notice for file {db_message_id} to user {sent_message.chat.id}. Error: {e}")
+        # The file still has to expire on time, even without its notice and countdown
+        await asyncio.sleep(max(0, AUTO_DELETE_TIME - (time.monotonic() - delivered_at)))
+        try: await sent_message.delete()
+        except Exception as e: logger.error(f"Could not delete expired file {db_message_id} for user {sent_message.chat.id}. Error: {e}")
+        return
+    await handle_file_expiry(client, expiry_msg, sent_message, db_message_id)
 
 # ======================================================================================
 #                              *** Force Subscribe & Admin Commands ***
 # ======================================================================================
 
+@lru_cache(maxsize=8)
+def build_join_markup(invite_link: str, join_request: bool) -> InlineKeyboardMarkup:
+    """Builds the join-channel keyboard once; the invite link only changes on restart."""
+    button_text = "➡️ Request to Join Channel" if join_request else "➡️ Join Channel"
+    return InlineKeyboardMarkup([[InlineKeyboardButton(button_text, url=invite_link)]])
+
+@lru_cache(maxsize=4096)
+def render_force_msg(first: str, last: str, username: str, mention: str, user_id: int) -> str:
+    """Formats FORCE_MSG for a user; cached since users retry /start with the same details."""
+    return FORCE_MSG.format(first=first, last=last, username=username, mention=mention, id=user_id)
+
 async def force_sub_handler(client: Bot, message: Message):
     """Handles users who have not subscribed to the force-sub channel."""
-    buttons = []
-    if JOIN_REQUEST_ENABLE and client.invitelink:
-        invite_link = client.invitelink
-        button_text = "➡️ Request to Join Channel"
-    elif client.invitelink:
-        invite_link = client.invitelink
-        button_text = "➡️ Join Channel"
-    else:
+    if not client.invitelink:
         return await message.reply_text("The bot is currently under maintenance. Please try again later.")
 
-    buttons.append([InlineKeyboardButton(button_text, url=invite_link)])
+    reply_markup = build_join_markup(client.invitelink, JOIN_REQUEST_ENABLE)
     
     if len(message.command) > 1:
-        buttons.append([InlineKeyboardButton(text='🔄 Try Again', url=f"https://t.me/{client.username}?start={message.command[1]}")])
+        try_again = InlineKeyboardButton(text='🔄 Try Again', url=f"https://t.me/{client.username}?start={message.command[1]}")
+        reply_markup = InlineKeyboardMarkup(reply_markup.inline_keyboard + [[try_again]])
 
     await message.reply(
-        text=FORCE_MSG.format(
+        text=render_force_msg(
             first=message.from_user.first_name,
             last=message.from_user.last_name or "",
             username=f"@{message.from_user.username}" if message.from_user.username else "N/A",
             mention=message.from_user.mention,
-            id=message.from_user.id
+            user_id=message.from_user.id
         ),
-        reply_markup=InlineKeyboardMarkup(buttons),
+        reply_markup=reply_markup,
         quote=True,
         disable_web_page_preview=True
     )
@@ -250,37 +349,17 @@ async def broadcast_command(client: Bot, message: Message):
     pls_wait = await message.reply_text("<i>Broadcasting Message... This will take some time.</i>")
     broadcast_msg = message.reply_to_message
     
-    total_users = await get_all_user_ids()
-    successful, blocked, deleted, unsuccessful = 0, 0, 0, 0
-
-    for user_id in total_users:
-        try:
-            await broadcast_msg.copy(user_id)
-            successful += 1
-        except FloodWait as e:
-            await asyncio.sleep(e.value)
-            await broadcast_msg.copy(user_id)
-            successful += 1
-        except (UserIsBlocked, InputUserDeactivated) as e:
-            await delete_user(user_id)
-            if isinstance(e, UserIsBlocked): blocked += 1
-            else: deleted += 1
-        except Exception as e:
-            unsuccessful += 1
-            logger.error(f"Failed to broadcast to {user_id}. Error: {e}")
-        
-        if (successful + blocked + deleted + unsuccessful) % 100 == 0:
-            try:
-                await pls_wait.edit(f"<i>Broadcasting...</i>\n\n<b>Sent:</b> {successful}\n<b>Blocked:</b> {blocked}\n<b>Failed:</b> {unsuccessful}")
-            except MessageNotModified:
-                pass
+    counts = await broadcast_message(
+        broadcast_msg, iter_user_ids(), status_msg=pls_wait,
+        progress_text="<i>Broadcasting...</i>\n\n<b>Sent:</b> {successful}\n<b>Blocked:</b> {blocked}\n<b>Failed:</b> {unsuccessful}"
+    )
     
     status = (
         f"<b><u>Broadcast Completed</u></b>\n\n"
-        f"<b>Total Users:</b> <code>{len(total_users)}</code>\n"
-        f"<b>✅ Successful:</b> <code>{successful}</code>\n"
-        f"<b>🚫 Blocked Users:</b> <code>{blocked}</code>\n"
-        f"<b>🗑️ Deleted Accounts:</b> <code>{deleted}</code>\n"
-        f"<b>❌ Unsuccessful:</b> <code>{unsuccessful}</code>"
+        f"<b>Total Users:</b> <code>{counts['total']}</code>\n"
+        f"<b>✅ Successful:</b> <code>{counts['successful']}</code>\n"
+        f"<b>🚫 Blocked Users:</b> <code>{counts['blocked']}</code>\n"
+        f"<b>🗑️ Deleted Accounts:</b> <code>{counts['deleted']}</code>\n"
+        f"<b>❌ Unsuccessful:</b> <code>{counts['unsuccessful']}</code>"
     )
     await pls_wait.edit(status)
\ No newline at end of file
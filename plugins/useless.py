@@ -3,6 +3,7 @@
 
 This plugin handles miscellaneous commands and fallback messages.
 - /stats: A quick command for admins to see bot status.
+- /pool: Shows the connection and worker pool settings for tuning.
 - A fallback handler for any private message that isn't a command.
 """
 
@@ -11,9 +12,9 @@ from pyrogram import filters
 from pyrogram.types import Message
 
 from bot import Bot
-from config import ADMINS
+from config import ADMINS, ADMINS_SET, TG_BOT_WORKERS, MAX_CONCURRENT_TRANSMISSIONS
 from helper_func import get_readable_time
-from database.database import get_all_user_ids
+from database.database import count_users, dbclient
 
 @Bot.on_message(filters.command('stats') & filters.user(ADMINS))
 async def stats_command(bot: Bot, message: Message):
@@ -22,39 +23,56 @@ async def stats_command(bot: Bot, message: Message):
     delta = now - bot.uptime
     uptime_str = get_readable_time(delta.seconds)
     
-    total_users = await get_all_user_ids()
+    total_users = await count_users()
     
     stats_text = (
         "📊 <b>HD Cinema Bot Status</b>\n\n"
         f" » <b>Bot Uptime:</b> <code>{uptime_str}</code>\n"
-        f" » <b>Active Users:</b> <code>{len(total_users)}</code>"
+        f" » <b>Active Users:</b> <code>{total_users}</code>"
     )
     
     await message.reply(stats_text)
 
 
+@Bot.on_message(filters.command('pool') & filters.user(ADMINS))
+async def pool_command(bot: Bot, message: Message):
+    """Shows the Telegram and MongoDB pool settings the bot is running with."""
+    pool_options = dbclient.options.pool_options
+
+    pool_text = (
+        "🧵 <b>Connection Pools</b>\n\n"
+        f" » <b>Update Workers:</b> <code>{TG_BOT_WORKERS}</code>\n"
+        f" » <b>Max Transmissions:</b> <code>{MAX_CONCURRENT_TRANSMISSIONS}</code>\n"
+        f" » <b>MongoDB Pool:</b> <code>{pool_options.min_pool_size}-{pool_options.max_pool_size}</code>"
+    )
+
+    await message.reply(pool_text)
+
+
+async def is_unhandled_message(_, client: Bot, message: Message) -> bool:
+    """Rejects the bot's own messages and admin media, which the linker plugin handles."""
+    # This prevents the bot from replying to its own messages or edits.
+    if message.from_user.id == client.me.id:
+        return False
+
+    # Ignore media messages from admins, as they are handled by the linker plugin.
+    if message.from_user.id in ADMINS_SET and message.media:
+        return False
+
+    return True
+
+unhandled_message_filter = filters.create(is_unhandled_message)
+
+
 # This handler is in a lower priority group. It will only run if no other
 # handlers in the default group (like /start) process the message first.
-@Bot.on_message(filters.private, group=1)
+# Commands are rejected by the filter chain itself, before the handler is scheduled.
+@Bot.on_message(filters.private & filters.incoming & ~filters.regex(r"^/") & unhandled_message_filter, group=1)
 async def unhandled_message_handler(client: Bot, message: Message):
     """
     Handles any incoming private message that isn't a recognized command.
     Politely informs the user that the bot is not for chatting.
     """
-    # This prevents the bot from replying to its own messages or edits.
-    if message.from_user.id == client.me.id:
-        return
-
-    # FIXED: Explicitly ignore any message that is a command.
-    # This is the most reliable way to prevent this handler from running
-    # after a command like /start has already been processed.
-    if message.text and message.text.startswith('/'):
-        return
-
-    # Ignore media messages from admins, as they are handled by the linker plugin.
-    if message.from_user.id in ADMINS and message.media:
-        return
-
     reply_text = (
         "👋 Hello! I am the HD Cinema File Bot.\n\n"
         "I am not designed for chatting. I can only provide files through special links "
@@ -7,19 +7,24 @@ This is a complete, rewritten version with a redesigned UI and full functionalit
 """
 
 import asyncio
+import bisect
 import cv2
-import math
+import io
+import numpy as np
 import os
 import random
+import re
+import threading
 import time
 import ffmpeg
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from pyrogram import filters, Client
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InputMediaPhoto, InputMediaVideo
-from pyrogram.errors import MessageNotModified
+from pyrogram.errors import MessageNotModified, FloodWait
 
 from bot import Bot
-from config import ADMINS, TEMP_DIR, SCREENSHOT_WATERMARK
+from config import ADMINS, TEMP_DIR, SCREENSHOT_WATERMARK, SESSION_TIMEOUT
 from helper_func import get_readable_time, format_bytes
 from plugins.linker import CONVERSATION_STATE # Import the state manager
 
@@ -29,6 +34,95 @@ logger = logging.getLogger(__name__)
 # --- In-memory storage for active workspace sessions ---
 WORKSPACE_SESSIONS = {}
 
+# How often idle sessions are looked for, in seconds
+JANITOR_INTERVAL = 60
+
+# Screenshots rendered at the same time, across all jobs (one per core)
+SCREENSHOT_CONCURRENCY = os.cpu_count() or 4
+SCREENSHOT_SEMAPHORE = asyncio.Semaphore(SCREENSHOT_CONCURRENCY)
+# Dedicated threads for decoding/encoding, so renders never queue behind other to_thread work
+RENDER_EXECUTOR = ThreadPoolExecutor(max_workers=SCREENSHOT_CONCURRENCY, thread_name_prefix="ws-render")
+# A clip may start up to this many seconds before the requested time so it can be stream-copied from a keyframe
+CLIP_KEYFRAME_TOLERANCE = 2.0
+# ffmpeg processes allowed to run at the same time, across all jobs
+FFMPEG_CONCURRENCY = 2
+FFMPEG_SEMAPHORE = asyncio.Semaphore(FFMPEG_CONCURRENCY)
+# Largest difference (in seconds) between a stream-copied clip and the requested length before it is re-encoded
+CLIP_DURATION_TOLERANCE = 2.0
+# Size of the chunks stream_media yields; its offset and limit are counted in these
+STREAM_CHUNK_SIZE = 1024 * 1024
+# A clip whose end falls within roughly this many bytes of an uncached, streamable video is cut
+# from a live stream instead of a full download; past that, downloading and stream-copying is faster
+STREAM_CLIP_MAX_BYTES = 100 * 1024 * 1024
+# Write buffer for downloads; flushes every 4 chunks
+DOWNLOAD_BUFFER_SIZE = 4 * STREAM_CHUNK_SIZE
+# Byte ranges of a video downloaded in parallel (also bounded by MAX_CONCURRENT_TRANSMISSIONS)
+DOWNLOAD_PARTS = 4
+# A capture at most this many frames behind a shot steps forward with grab() instead of seeking
+GRAB_AHEAD_LIMIT = 48
+# Screenshot encoding: quality 95 with optimized Huffman tables (smaller uploads, same pixels)
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 95, cv2.IMWRITE_JPEG_OPTIMIZE, 1, cv2.IMWRITE_JPEG_PROGRESSIVE, 0]
+# Workspace callback data: ws|<action>|<subaction>|<msg_id>[|<value>]
+CALLBACK_PATTERN = re.compile(r"^ws\|(?P<action>\w+)\|(?P<subaction>\w+)\|(?P<msg_id>\d+)(?:\|(?P<value>\d+))?$")
+# The watermark never changes, so its size is measured once
+WATERMARK_SIZE = cv2.getTextSize(SCREENSHOT_WATERMARK, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0] if SCREENSHOT_WATERMARK else (0, 0)
+# Padding around the pre-rendered watermark, enough for its 6px outline
+WATERMARK_MARGIN = 4
+# Telegram's limit on items per media group
+MEDIA_GROUP_SIZE = 10
+# Seconds without a new item before a partial media group is sent anyway
+UPLOAD_IDLE_FLUSH = 2.0
+# Per render thread frame buffer, reused from one screenshot to the next
+_frame_buffers = threading.local()
+# Minimum seconds between edits of a job's status message
+STATUS_EDIT_INTERVAL = 2.0
+
+class StatusThrottle:
+    """
+    Coalesces edits of a status message to at most one every `interval` seconds.
+    Only the latest text is kept; if an update arrives too early it is sent by a
+    short-lived flush task once the interval has passed.
+    """
+
+    def __init__(self, message: Message, interval: float = STATUS_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self.last_edit = 0.0
+        self.pending = None
+        self.flush_task = None
+
+    async def set(self, text: str):
+        self.pending = text
+        wait = self.last_edit + self.interval - time.monotonic()
+        if wait <= 0:
+            await self._edit()
+        elif not self.flush_task:
+            self.flush_task = asyncio.create_task(self._flush_later(wait))
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self.flush_task = None
+        await self._edit()
+
+    async def _edit(self):
+        text, self.pending = self.pending, None
+        if text is None:
+            return
+        self.last_edit = time.monotonic()
+        try:
+            await self.message.edit_text(text)
+        except (MessageNotModified, FloodWait):
+            pass
+        except Exception as e:
+            logger.warning(f"Could not update workspace status: {e}")
+
+    def cancel(self):
+        """Drops any queued update, so the message can be edited or deleted directly."""
+        self.pending = None
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+
 # ======================================================================================
 #                              *** UI & Core Logic ***
 # ======================================================================================
@@ -56,16 +150,300 @@ def get_main_workspace_markup(msg_id: int) -> InlineKeyboardMarkup:
         [InlineKeyboardButton("🗑️ Close Session", callback_data=f"ws|menu|cleanup|{msg_id}")]
     ])
 
-def parse_callback_data(data: str) -> dict:
-    """Parses the new callback data format."""
-    parts = data.split("|")
-    return {
-        "type": parts[0],
-        "action": parts[1],
-        "subaction": parts[2],
-        "msg_id": int(parts[3]),
-        "value": parts[4] if len(parts) > 4 else None
-    }
+def parse_timestamp(timestamp: str) -> int:
+    """Converts HH:MM:SS, MM:SS or SS into seconds."""
+    seconds = 0
+    for part in timestamp.strip().split(':'):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+def _open_capture(file_path: str):
+    """
+    Opens a VideoCapture on the FFmpeg backend, asking for hardware-accelerated decoding
+    (NVDEC, VAAPI, ...) when this OpenCV build supports it, and plain software decoding otherwise.
+    The backend is named explicitly so OpenCV doesn't probe the others first. Decoder options
+    such as the thread count can be tuned with OPENCV_FFMPEG_CAPTURE_OPTIONS (e.g. "threads;auto").
+    """
+    if hasattr(cv2, 'CAP_PROP_HW_ACCELERATION'):
+        cap = cv2.VideoCapture(file_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            return cap
+        cap.release()
+    return cv2.VideoCapture(file_path, cv2.CAP_FFMPEG)
+
+async def _acquire_capture(session: dict):
+    """Takes an idle VideoCapture from the session's pool, opening a new one only when all are busy."""
+    if session['captures']:
+        return session['captures'].pop()
+    return await asyncio.to_thread(_open_capture, session['file_path'])
+
+def _return_capture(session: dict, cap):
+    """Puts a capture back in its session's pool, or releases it if that session has since been closed or replaced."""
+    if any(live is session for live in WORKSPACE_SESSIONS.values()):
+        session['captures'].append(cap)
+    else:
+        RENDER_EXECUTOR.submit(cap.release)
+
+def _release_captures(session: dict):
+    """Closes every pooled VideoCapture of a session."""
+    for cap in session.get('captures', []):
+        cap.release()
+    session['captures'] = []
+
+def _remove_files(paths: list):
+    """Deletes the given files if they exist. Called through asyncio.to_thread, off the event loop."""
+    for path in paths:
+        if os.path.exists(path):
+            try: os.remove(path)
+            except Exception as e: logger.error(f"Cleanup Error: Could not delete {path}: {e}")
+
+def _close_session(session: dict):
+    """Releases a session's captures and deletes its downloaded video. Called through asyncio.to_thread."""
+    _release_captures(session)
+    if session.get('file_path'):
+        _remove_files([session['file_path']])
+
+def _rasterize_watermark():
+    """
+    Draws the watermark once (black outline, white fill, anti-aliased) into alpha masks and
+    folds them into per-pixel scale/offset arrays, so stamping a screenshot is a single
+    multiply-add over a small region instead of two putText calls.
+    """
+    (w, h), baseline = cv2.getTextSize(SCREENSHOT_WATERMARK, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+    m = WATERMARK_MARGIN
+    outline = np.zeros((h + baseline + 2 * m, w + 2 * m), np.uint8)
+    fill = np.zeros_like(outline)
+    cv2.putText(outline, SCREENSHOT_WATERMARK, (m, m + h), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 255, 6, cv2.LINE_AA)
+    cv2.putText(fill, SCREENSHOT_WATERMARK, (m, m + h), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 255, 2, cv2.LINE_AA)
+    outline_alpha = outline.astype(np.float32) / 255
+    fill_alpha = fill.astype(np.float32) / 255
+    # pixel -> pixel * (1 - outline) * (1 - fill) + 255 * fill, same as drawing both layers in turn
+    scale = ((1 - outline_alpha) * (1 - fill_alpha))[..., None]
+    offset = (255 * fill_alpha)[..., None]
+    return scale, offset
+
+WATERMARK_OVERLAY = _rasterize_watermark() if SCREENSHOT_WATERMARK else None
+
+def _stamp_watermark(frame):
+    """Blends the pre-rendered watermark into the bottom-right corner of frame, in place."""
+    scale, offset = WATERMARK_OVERLAY
+    y0 = frame.shape[0] - 15 - WATERMARK_SIZE[1] - WATERMARK_MARGIN
+    x0 = frame.shape[1] - 15 - WATERMARK_SIZE[0] - WATERMARK_MARGIN
+    if y0 < 0 or x0 < 0 or y0 + scale.shape[0] > frame.shape[0]:
+        # Frame too small for the overlay region; draw the text directly
+        origin = (frame.shape[1] - WATERMARK_SIZE[0] - 15, frame.shape[0] - 15)
+        cv2.putText(frame, SCREENSHOT_WATERMARK, origin, cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 6, cv2.LINE_AA)
+        cv2.putText(frame, SCREENSHOT_WATERMARK, origin, cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2, cv2.LINE_AA)
+        return
+    region = frame[y0:y0 + scale.shape[0], x0:x0 + scale.shape[1]]
+    region[:] = (region * scale + offset).astype(np.uint8)
+
+def _render_frame(cap, frame_num: int, fps: float):
+    """
+    Seeks cap to frame_num, stamps the timestamp and watermark on it and returns it
+    JPEG-encoded in memory, or None if the frame could not be read.
+    Runs in a worker thread; each concurrent shot uses its own VideoCapture from the
+    session pool, and OpenCV releases the GIL while decoding and encoding.
+    """
+    gap = frame_num - int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if 0 <= gap <= GRAB_AHEAD_LIMIT:
+        # Close ahead of where this capture already is: step forward rather than seek back to a keyframe
+        for _ in range(gap):
+            cap.grab()
+    else:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+    if not cap.grab():
+        return None
+    # Decode into this thread's previous frame; OpenCV reuses it when the size matches
+    ret, frame = cap.retrieve(getattr(_frame_buffers, 'frame', None))
+    if not ret:
+        return None
+    _frame_buffers.frame = frame
+    timestamp_display = get_readable_time(frame_num / fps)
+    cv2.putText(frame, timestamp_display, (15, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 6, cv2.LINE_AA)
+    cv2.putText(frame, timestamp_display, (15, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2, cv2.LINE_AA)
+    if WATERMARK_OVERLAY:
+        _stamp_watermark(frame)
+    ok, buffer = cv2.imencode('.jpg', frame, JPEG_PARAMS)
+    return buffer.tobytes() if ok else None
+
+def _probe_video(file_path: str) -> dict:
+    """Reads fps, frame count and duration of the first video stream with ffprobe."""
+    probe = ffmpeg.probe(file_path, select_streams='v:0')
+    stream = probe['streams'][0]
+    num, _, den = stream.get('r_frame_rate', '0/1').partition('/')
+    fps = float(num) / float(den or 1) if float(den or 1) else 0.0
+    duration = float(stream.get('duration') or probe.get('format', {}).get('duration') or 0)
+    total_frames = int(stream['nb_frames']) if stream.get('nb_frames', '').isdigit() else int(duration * fps)
+    return {'fps': fps, 'total_frames': total_frames, 'duration': duration}
+
+def _list_keyframes(file_path: str, read_intervals: str = None) -> list:
+    """
+    Returns the sorted timestamps (in seconds) of the video's keyframes, read from packet flags without decoding.
+    With read_intervals (ffprobe syntax, e.g. "120%+4"), only packets in that window are read instead of the whole file.
+    """
+    probe_args = {'read_intervals': read_intervals} if read_intervals else {}
+    probe = ffmpeg.probe(file_path, select_streams='v:0', show_entries='packet=pts_time,flags', **probe_args)
+    return sorted(
+        float(packet['pts_time'])
+        for packet in probe.get('packets', [])
+        if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A')
+    )
+
+async def _get_keyframes(session: dict) -> list:
+    """Returns the session video's keyframe timestamps, listing them on first use."""
+    if session.get('keyframes') is None:
+        session['keyframes'] = await asyncio.to_thread(_list_keyframes, session['file_path'])
+    return session['keyframes']
+
+async def _get_keyframes_near(session: dict, start_time_sec: float) -> list:
+    """
+    Returns keyframe timestamps covering the CLIP_KEYFRAME_TOLERANCE window before start_time_sec: the
+    session's full list when one exists, otherwise just the keyframes from a short probe around the start.
+    """
+    if session.get('keyframes') is not None:
+        return session['keyframes']
+    window_start = max(0, start_time_sec - CLIP_KEYFRAME_TOLERANCE - 1)
+    return await asyncio.to_thread(_list_keyframes, session['file_path'], f"{window_start}%+{CLIP_KEYFRAME_TOLERANCE + 2}")
+
+async def _download_video(client: Client, video_message: Message, file_path: str, progress):
+    """
+    Downloads the message's video into file_path as DOWNLOAD_PARTS ranges fetched in parallel.
+    Each range streams through its own large write buffer at its offset in a pre-sized file;
+    progress is reported with the combined byte count.
+    """
+    media = video_message.video or video_message.document
+    total = getattr(media, 'file_size', 0) or 0
+    chunk_count = -(-total // STREAM_CHUNK_SIZE)
+    # Without a known size the file can't be split, so it is streamed in one piece
+    part_chunks = -(-chunk_count // DOWNLOAD_PARTS) if chunk_count else 0
+    current = 0
+
+    async def fetch_range(first_chunk: int, limit: int):
+        nonlocal current
+        with open(file_path, 'r+b', buffering=DOWNLOAD_BUFFER_SIZE) as f:
+            f.seek(first_chunk * STREAM_CHUNK_SIZE)
+            async for chunk in client.stream_media(video_message, offset=first_chunk, limit=limit):
+                f.write(chunk)
+                current += len(chunk)
+                await progress(current, total)
+
+    with open(file_path, 'wb') as f:
+        f.truncate(total)
+    ranges = [(first, min(part_chunks, chunk_count - first)) for first in range(0, chunk_count, part_chunks)] if part_chunks else [(0, 0)]
+    tasks = [asyncio.create_task(fetch_range(first, limit)) for first, limit in ranges]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Never leave a truncated video behind for the next job to pick up
+        await asyncio.to_thread(_remove_files, [file_path])
+        raise
+
+async def _clip_from_stream(client: Client, video_message: Message, start_time_sec: float, duration: int, clip_path: str):
+    """
+    Cuts a clip by piping the video from Telegram straight into ffmpeg, without downloading it
+    first. ffmpeg exits once it has written `duration` seconds, which closes the pipe and stops
+    the rest of the video from being fetched. The input can't be seeked, so the clip is re-encoded.
+    """
+    stream = ffmpeg.input('pipe:0', ss=start_time_sec).output(clip_path, t=duration, vcodec='libx264', acodec='copy', strict='-2')
+    args = ffmpeg.compile(stream, overwrite_output=True)
+    async with FFMPEG_SEMAPHORE:
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+        stderr_reader = asyncio.create_task(proc.stderr.read())
+        try:
+            async for chunk in client.stream_media(video_message):
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # ffmpeg has all it needs and has closed its end
+        finally:
+            proc.stdin.close()
+        await proc.wait()
+        stderr = await stderr_reader
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {proc.returncode}: {stderr.decode(errors='ignore')[-300:]}")
+
+def _rewind_media(batch: list):
+    """Seeks in-memory media back to the start so a retried upload reads the whole file again."""
+    for item in batch:
+        if isinstance(item.media, io.BytesIO):
+            item.media.seek(0)
+
+async def _upload_media(client: Client, chat_id: int, upload_queue: asyncio.Queue, status: StatusThrottle) -> int:
+    """
+    Sends media from upload_queue in groups of MEDIA_GROUP_SIZE as soon as a group fills.
+    A partial group is sent once nothing new has arrived for UPLOAD_IDLE_FLUSH seconds,
+    and whatever is left when the None sentinel arrives. Returns the number of items sent.
+    """
+    batch = []
+    batch_number = 0
+    sent = 0
+    while True:
+        try:
+            item = await asyncio.wait_for(upload_queue.get(), UPLOAD_IDLE_FLUSH) if batch else await upload_queue.get()
+            idle = False
+        except asyncio.TimeoutError:
+            item, idle = None, True
+        if item is not None:
+            batch.append(item)
+        if len(batch) == MEDIA_GROUP_SIZE or (item is None and batch):
+            batch_number += 1
+            await status.set(f"<code>Uploading batch {batch_number}...</code>")
+            while True:
+                try:
+                    await client.send_media_group(chat_id, media=batch)
+                    break
+                except FloodWait as e:
+                    logger.warning(f"FloodWait of {e.value}s while uploading workspace media, retrying.")
+                    await asyncio.sleep(e.value)
+                    _rewind_media(batch)
+            sent += len(batch)
+            batch = []
+        if item is None and not idle:
+            return sent
+
+async def _run_ffmpeg(stream):
+    """
+    Runs a compiled ffmpeg-python stream as an asyncio subprocess and raises with its stderr on failure.
+    At most FFMPEG_CONCURRENCY run at once; further jobs wait for a free slot.
+    """
+    args = ffmpeg.compile(stream, overwrite_output=True)
+    async with FFMPEG_SEMAPHORE:
+        proc = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+        _, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {proc.returncode}: {stderr.decode(errors='ignore')[-300:]}")
+
+async def workspace_janitor():
+    """
+    Background task started by the bot: every JANITOR_INTERVAL seconds, closes sessions
+    idle for longer than SESSION_TIMEOUT, releasing their captures and deleting their video.
+    Sessions with a job still running are left alone.
+    """
+    while True:
+        await asyncio.sleep(JANITOR_INTERVAL)
+        now = time.time()
+        expired = [
+            user_id for user_id, session in WORKSPACE_SESSIONS.items()
+            if not session['jobs'] and now - session['last_active'] > SESSION_TIMEOUT
+        ]
+        for user_id in expired:
+            try:
+                # Re-checked here: the session may have been closed, replaced or resumed while an earlier one was closing
+                session = WORKSPACE_SESSIONS.get(user_id)
+                if not session or session['jobs'] or time.time() - session['last_active'] <= SESSION_TIMEOUT:
+                    continue
+                session = WORKSPACE_SESSIONS.pop(user_id, None)
+                if session is None:
+                    continue
+                logger.info(f"Closing idle workspace session of user {user_id}.")
+                await asyncio.to_thread(_close_session, session)
+            except Exception as e:
+                logger.error(f"Workspace janitor failed to close session of user {user_id}: {e}", exc_info=True)
 
 # ======================================================================================
 #                              *** Command & Message Handlers ***
@@ -76,11 +454,9 @@ async def process_command_handler(client: Bot, message: Message):
     """Entry point for the /process command. Sets the user's state."""
     user_id = message.from_user.id
     
-    if user_id in WORKSPACE_SESSIONS:
-        session = WORKSPACE_SESSIONS.pop(user_id, None)
-        if session and 'file_path' in session and os.path.exists(session['file_path']):
-            try: os.remove(session['file_path'])
-            except Exception as e: logger.error(f"Cleanup Error: Could not delete previous session file for {user_id}. {e}")
+    session = WORKSPACE_SESSIONS.pop(user_id, None)
+    if session:
+        await asyncio.to_thread(_close_session, session)
 
     CONVERSATION_STATE[user_id] = 'awaiting_process_video'
     await message.reply_text("➡️ Please send the video file you want to work on...")
@@ -100,10 +476,16 @@ async def workspace_video_handler(client: Bot, message: Message):
     video = message.video or message.document
     WORKSPACE_SESSIONS[user_id] = {
         'msg_id': message.id,
+        'video_message': message, # Kept so jobs can download it without fetching it again
         'file_name': getattr(video, 'file_name', f"File_{message.id}"),
         'file_size': getattr(video, 'file_size', 0),
         'duration': getattr(video, 'duration', 0) or 0,
         'file_path': None,
+        'meta': None,
+        'keyframes': None,
+        'captures': [],
+        'jobs': 0,
+        'download_lock': asyncio.Lock(),
         'last_active': time.time()
     }
     
@@ -115,12 +497,13 @@ async def workspace_video_handler(client: Bot, message: Message):
 #                              *** Callback & Backend Logic ***
 # ======================================================================================
 
-@Bot.on_callback_query(filters.regex("^ws|") & filters.user(ADMINS))
+@Bot.on_callback_query(filters.regex(CALLBACK_PATTERN) & filters.user(ADMINS))
 async def workspace_callback_handler(client: Bot, query: CallbackQuery):
     """Handles all button presses within the workspace using the new data format."""
     user_id = query.from_user.id
-    data = parse_callback_data(query.data)
-    msg_id = data['msg_id']
+    # filters.regex already matched the data; reuse its groups instead of parsing again
+    data = query.matches[0]
+    msg_id = int(data['msg_id'])
 
     if user_id not in WORKSPACE_SESSIONS or WORKSPACE_SESSIONS[user_id]['msg_id'] != msg_id:
         return await query.answer("This workspace session has expired. Please start a new one with /process.", show_alert=True)
@@ -148,10 +531,9 @@ async def workspace_callback_handler(client: Bot, query: CallbackQuery):
         
         elif subaction == "cleanup":
             await query.answer("Closing session...", show_alert=False)
-            if session and session.get('file_path') and os.path.exists(session['file_path']):
-                try: os.remove(session['file_path'])
-                except Exception as e: logger.error(f"Cleanup Error: Could not delete session file for user {user_id}: {e}")
-            WORKSPACE_SESSIONS.pop(user_id, None)
+            closed_session = WORKSPACE_SESSIONS.pop(user_id, None)
+            if closed_session:
+                await asyncio.to_thread(_close_session, closed_session)
             await query.message.edit_text("🗑️ <b>Workspace Closed</b>\nAll temporary files have been removed.")
 
     elif action == "ss": # Screenshot actions
@@ -184,7 +566,7 @@ async def workspace_callback_handler(client: Bot, query: CallbackQuery):
 
         elif subaction == "manual":
             CONVERSATION_STATE[user_id] = 'awaiting_clip_details'
-            await query.message.edit_text("📝 <b>Send Clip Details</b>\n\nReply like: <code>00:01:30 20</code> to clip 20s from 1m30s.\n(Max duration: 60s)")
+            await query.message.edit_text("📝 <b>Send Clip Details</b>\n\nReply like: <code>00:01:30 20</code> to clip 20s from 1m30s.\nAdd <code>exact</code> to cut on that exact frame (slower).\n(Max duration: 60s)")
         
         elif subaction == "take_random":
             duration = int(data['value'])
@@ -205,13 +587,14 @@ async def details_handler(client: Bot, message: Message):
     
     if state == 'awaiting_clip_details':
         try:
-            start_time, duration_str = message.text.split(" ", 1)
+            start_time, duration_str, *flags = message.text.split()
             duration_sec = int(duration_str)
+            frame_accurate = 'exact' in (flag.lower() for flag in flags)
             if duration_sec > 60: return await message.reply_text("Maximum clip duration is 60 seconds. Please try again.")
         except Exception: return await message.reply_text("<b>Invalid format.</b> Reply with <code>start_time duration</code> (e.g., <code>00:01:30 15</code>)")
         
         await message.delete()
-        asyncio.create_task(run_process_and_notify(client, user_id, clip_job={"start_time": start_time, "duration": duration_sec, "random": False}))
+        asyncio.create_task(run_process_and_notify(client, user_id, clip_job={"start_time": start_time, "duration": duration_sec, "random": False, "frame_accurate": frame_accurate}))
 
     elif state == 'awaiting_ss_timestamps':
         timestamps = [ts.strip() for ts in message.text.split(',')]
@@ -225,115 +608,201 @@ async def run_process_and_notify(client: Bot, user_id: int, screenshot_job=None,
     
     session = WORKSPACE_SESSIONS[user_id]
     video_message_id = session['msg_id']
+    session['jobs'] += 1
     
     status_update_msg = None
+    status = None
     generated_media_paths = []
 
     try:
-        if not session.get('file_path') or not os.path.exists(session.get('file_path')):
-            status_update_msg = await client.send_message(user_id, "📥 <b>Starting download...</b>")
-            video_message = await client.get_messages(user_id, video_message_id)
-            file_path = os.path.join(TEMP_DIR, f"{video_message.id}.mp4")
-            os.makedirs(TEMP_DIR, exist_ok=True)
-            
-            start_download_time = time.time()
+        video_duration = (session.get('meta') or {}).get('duration') or session['duration']
+        clip_start = None
+        if clip_job:
+            clip_duration = clip_job['duration']
+            if not clip_job.get('random'):
+                clip_start = parse_timestamp(clip_job['start_time'])
+            elif video_duration:
+                clip_start = random.uniform(0, max(0, video_duration - clip_duration))
+
+        async def show_status(text: str):
+            nonlocal status_update_msg, status
+            if status:
+                await status.set(text)
+            else:
+                status_update_msg = await client.send_message(user_id, text)
+                status = StatusThrottle(status_update_msg)
+
+        # A clip-only job on a video that isn't downloaded yet can skip the download when the clip sits
+        # near the start of a streamable (moov-first) video: only the bytes up to the clip's end are fetched.
+        video = session['video_message'].video
+        stream_clip = bool(
+            clip_job and not screenshot_job and clip_start is not None and video and video.supports_streaming
+            and video_duration and not (session.get('file_path') and os.path.exists(session['file_path']))
+            and session['file_size'] * (clip_start + clip_duration) / video_duration <= STREAM_CLIP_MAX_BYTES
+        )
+
+        if stream_clip:
+            await show_status("📡 <b>Streaming the clip's part of the video...</b>")
+            await asyncio.to_thread(os.makedirs, TEMP_DIR, exist_ok=True)
+            stream_clip_path = os.path.join(TEMP_DIR, f"clip_{int(time.time())}.mp4")
+            generated_media_paths.append(stream_clip_path)
+            try:
+                await _clip_from_stream(client, session['video_message'], clip_start, clip_duration, stream_clip_path)
+            except Exception as e:
+                # e.g. flagged as streamable but the moov atom isn't first; the download path always works
+                logger.warning(f"Streaming clip failed, downloading the video instead: {e}")
+                stream_clip = False
+
+        if not stream_clip:
+            # One download per session: a job arriving mid-download waits, then re-checks the cache
+            async with session['download_lock']:
+                if not session.get('file_path') or not os.path.exists(session.get('file_path')):
+                    await show_status("📥 <b>Starting download...</b>")
+                    video_message = session['video_message']
+                    file_path = os.path.join(TEMP_DIR, f"{video_message.id}.mp4")
+                    await asyncio.to_thread(os.makedirs, TEMP_DIR, exist_ok=True)
             
-            async def progress(current, total):
-                try:
-                    now = time.time()
-                    elapsed = now - start_download_time
-                    speed = current / elapsed if elapsed > 0 else 0
-                    eta = (total - current) / speed if speed > 0 else 0
+                    start_download_time = time.monotonic()
+                    last_percentage = -1
+                
+                    async def progress(current, total):
+                        nonlocal last_percentage
+                        percentage = int(current * 100 / total) if total else 0
+                        # Nothing visible would change; skip the formatting and the edit
+                        if percentage == last_percentage:
+                            return
+                        last_percentage = percentage
+                        elapsed = time.monotonic() - start_download_time
+                        speed = current / elapsed if elapsed > 0 else 0
+                        eta = (total - current) / speed if speed > 0 else 0
                     
-                    progress_str = (
-                        f"<b>Downloading Video...</b>\n\n"
-                        f"<b>Progress:</b> {current * 100 / total:.1f}%\n"
-                        f"<b>Speed:</b> {format_bytes(speed)}/s\n"
-                        f"<b>Downloaded:</b> {format_bytes(current)} / {format_bytes(total)}\n"
-                        f"<b>ETA:</b> {get_readable_time(int(eta))}"
-                    )
+                        progress_str = (
+                            f"<b>Downloading Video...</b>\n\n"
+                            f"<b>Progress:</b> {percentage}%\n"
+                            f"<b>Speed:</b> {format_bytes(speed)}/s\n"
+                            f"<b>Downloaded:</b> {format_bytes(current)} / {format_bytes(total)}\n"
+                            f"<b>ETA:</b> {get_readable_time(int(eta))}"
+                        )
                     
-                    await status_update_msg.edit_text(progress_str)
-                except MessageNotModified:
-                    pass
+                        await status.set(progress_str)
             
-            await client.download_media(video_message, file_name=file_path, progress=progress)
-            session['file_path'] = file_path
-        else:
-            status_update_msg = await client.send_message(user_id, "<b>Using cached video from current session...</b>")
-            file_path = session['file_path']
-        
-        session['last_active'] = time.time()
+                    await _download_video(client, video_message, file_path, progress)
+                    _release_captures(session)
+                    session['file_path'] = file_path
+                    session['meta'] = None
+                    session['keyframes'] = None
+                else:
+                    await show_status("<b>Using cached video from current session...</b>")
+                    file_path = session['file_path']
         
-        await status_update_msg.edit_text("<code>Processing video... This may take a moment.</code>")
-        cap = cv2.VideoCapture(file_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        if fps == 0: raise ValueError("Could not read video properties (FPS is zero).")
-
-        generated_media = []
+            session['last_active'] = time.time()
         
-        if screenshot_job:
-            frames_to_capture = []
-            if screenshot_job.get('timestamps'):
-                for ts in screenshot_job['timestamps']:
-                    time_parts = list(map(int, ts.split(':')))
-                    while len(time_parts) < 3: time_parts.insert(0, 0)
-                    h, m, s = time_parts
-                    frame_num = int((h * 3600 + m * 60 + s) * fps)
-                    if 0 <= frame_num < total_frames: frames_to_capture.append(frame_num)
-            else:
-                frames_to_capture = sorted(random.sample(range(0, total_frames), min(screenshot_job['count'], total_frames)))
-            
-            for i, frame_num in enumerate(frames_to_capture):
-                await status_update_msg.edit_text(f"<code>Generating screenshot {i+1} of {len(frames_to_capture)}...</code>")
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-                ret, frame = cap.read()
-                if ret:
-                    timestamp_display = get_readable_time(frame_num / fps)
-                    cv2.putText(frame, timestamp_display, (15, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 6, cv2.LINE_AA)
-                    cv2.putText(frame, timestamp_display, (15, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2, cv2.LINE_AA)
-                    if SCREENSHOT_WATERMARK:
-                        (w, h), _ = cv2.getTextSize(SCREENSHOT_WATERMARK, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-                        cv2.putText(frame, SCREENSHOT_WATERMARK, (frame.shape[1] - w - 15, frame.shape[0] - 15), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 6, cv2.LINE_AA)
-                        cv2.putText(frame, SCREENSHOT_WATERMARK, (frame.shape[1] - w - 15, frame.shape[0] - 15), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2, cv2.LINE_AA)
-                    ss_path = os.path.join(TEMP_DIR, f"ss_{i+1}_{video_message_id}.jpg")
-                    cv2.imwrite(ss_path, frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
-                    generated_media.append(InputMediaPhoto(ss_path))
-                    generated_media_paths.append(ss_path)
-
-        if clip_job:
-            duration = clip_job['duration']
-            start_time_sec = 0
-            if clip_job.get('random'):
-                max_start_time = max(0, (total_frames / fps) - duration)
-                start_time_sec = random.uniform(0, max_start_time)
-            else:
-                time_parts = list(map(int, clip_job['start_time'].split(':')))
-                while len(time_parts) < 3: time_parts.insert(0, 0)
-                h, m, s = time_parts
-                start_time_sec = h * 3600 + m * 60 + s
+            await status.set("<code>Processing video... This may take a moment.</code>")
+            if not session.get('meta'):
+                session['meta'] = await asyncio.to_thread(_probe_video, file_path)
+            fps = session['meta']['fps']
+            total_frames = session['meta']['total_frames']
+            if fps == 0: raise ValueError("Could not read video properties (FPS is zero).")
+
+        # Media is uploaded by a separate task while the rest is still being generated
+        upload_queue = asyncio.Queue()
+        uploader = asyncio.create_task(_upload_media(client, user_id, upload_queue, status))
+        render_tasks = []
+        try:
+            if screenshot_job:
+                if screenshot_job.get('timestamps'):
+                    # A set, since repeated timestamps would decode the same frame twice
+                    frame_nums = {int(parse_timestamp(ts) * fps) for ts in screenshot_job['timestamps']}
+                    frames_to_capture = sorted(n for n in frame_nums if 0 <= n < total_frames)
+                else:
+                    # Random shots land on keyframes when there are enough of them, so each
+                    # seek decodes a single frame instead of decoding forward from a keyframe.
+                    count = screenshot_job['count']
+                    keyframes = await _get_keyframes(session)
+                    if len(keyframes) >= count:
+                        frames_to_capture = sorted({min(int(round(kf * fps)), total_frames - 1) for kf in random.sample(keyframes, count)})
+                    else:
+                        # Sample times over the probed duration; frame counts are unreliable for VFR videos
+                        video_duration = session['meta']['duration'] or total_frames / fps
+                        frames_to_capture = sorted({min(int(random.uniform(0, video_duration) * fps), total_frames - 1) for _ in range(count)})
             
-            start_time_str = get_readable_time(start_time_sec)
-            await status_update_msg.edit_text(f"<code>Generating {duration}s clip from {start_time_str}...</code>")
-            clip_path = os.path.join(TEMP_DIR, f"clip_{int(time.time())}.mp4")
-            (
-                ffmpeg.input(file_path, ss=start_time_sec)
-                .output(clip_path, t=duration, vcodec='libx264', acodec='copy', strict='-2')
-                .run(quiet=True, overwrite_output=True)
-            )
-            generated_media.append(InputMediaVideo(clip_path, caption=f"Clip from {start_time_str} ({duration}s)"))
-            generated_media_paths.append(clip_path)
-
-        if not generated_media: raise ValueError("Failed to generate any media.")
+                await status.set(f"<code>Generating {len(frames_to_capture)} screenshots...</code>")
+
+                async def render_shot(i: int, frame_num: int):
+                    async with SCREENSHOT_SEMAPHORE:
+                        shot_cap = await _acquire_capture(session)
+                        loop = asyncio.get_running_loop()
+                        render = RENDER_EXECUTOR.submit(_render_frame, shot_cap, frame_num, fps)
+                        # The capture is handed back only once the render thread is done with it,
+                        # even if this job is cancelled while the frame is still decoding.
+                        render.add_done_callback(lambda _: loop.call_soon_threadsafe(_return_capture, session, shot_cap))
+                        jpeg = await asyncio.wrap_future(render)
+                    if not jpeg:
+                        return None
+                    # Uploaded straight from memory; the screenshot never touches the disk
+                    photo = io.BytesIO(jpeg)
+                    photo.name = f"ss_{i+1}_{video_message_id}.jpg"
+                    return photo
+
+                # Shots render concurrently but are queued for upload in timeline order
+                render_tasks = [asyncio.create_task(render_shot(i, f)) for i, f in enumerate(frames_to_capture)]
+                for done, task in enumerate(render_tasks, 1):
+                    photo = await task
+                    if photo:
+                        await upload_queue.put(InputMediaPhoto(photo))
+                    # Coalesced by the throttle, so this costs no extra round trips per shot
+                    await status.set(f"<code>Generated {done} of {len(render_tasks)} screenshots...</code>")
+
+            if clip_job and stream_clip:
+                start_time_str = get_readable_time(int(clip_start))
+                await upload_queue.put(InputMediaVideo(stream_clip_path, caption=f"Clip from {start_time_str} ({clip_duration}s)"))
+
+            elif clip_job:
+                duration = clip_duration
+                start_time_sec = clip_start
+                if start_time_sec is None:
+                    # Duration wasn't known before the probe (e.g. sent as a document)
+                    start_time_sec = random.uniform(0, max(0, (session['meta']['duration'] or total_frames / fps) - duration))
             
-        for i in range(0, len(generated_media), 10):
-            chunk = generated_media[i:i + 10]
-            await status_update_msg.edit_text(f"<code>Uploading batch {i//10 + 1} of {math.ceil(len(generated_media)/10)}...</code>")
-            await client.send_media_group(user_id, media=chunk)
-            if len(generated_media) > 10:
-                await asyncio.sleep(5)
+                requested_start = start_time_sec
+                clip_path = os.path.join(TEMP_DIR, f"clip_{int(time.time())}.mp4")
+                reencode_stream = (
+                    ffmpeg.input(file_path, ss=requested_start, hwaccel='auto')
+                    .output(clip_path, t=duration, vcodec='libx264', acodec='copy', strict='-2')
+                )
+                clip_stream = reencode_stream
+                if not clip_job.get('frame_accurate'):
+                    keyframes = await _get_keyframes_near(session, requested_start)
+                    kf_index = bisect.bisect_right(keyframes, requested_start) - 1
+                    if kf_index >= 0 and requested_start - keyframes[kf_index] <= CLIP_KEYFRAME_TOLERANCE:
+                        # Starting on a keyframe lets the packets be copied as-is, with no re-encode
+                        start_time_sec = keyframes[kf_index]
+                        clip_stream = ffmpeg.input(file_path, ss=start_time_sec).output(
+                            clip_path, t=duration, c='copy', movflags='+faststart', avoid_negative_ts='make_zero'
+                        )
+
+                start_time_str = get_readable_time(int(start_time_sec))
+                await status.set(f"<code>Generating {duration}s clip from {start_time_str}...</code>")
+                generated_media_paths.append(clip_path)
+                await _run_ffmpeg(clip_stream)
+                if clip_stream is not reencode_stream:
+                    # A stream copy that came out noticeably short or long is redone with a re-encode
+                    expected = min(duration, session['meta']['duration'] - start_time_sec) if session['meta']['duration'] else duration
+                    actual = (await asyncio.to_thread(_probe_video, clip_path))['duration']
+                    if abs(actual - expected) > CLIP_DURATION_TOLERANCE:
+                        logger.info(f"Stream-copied clip is {actual:.1f}s instead of {expected:.1f}s, re-encoding.")
+                        start_time_sec = requested_start
+                        start_time_str = get_readable_time(int(start_time_sec))
+                        await _run_ffmpeg(reencode_stream)
+                await upload_queue.put(InputMediaVideo(clip_path, caption=f"Clip from {start_time_str} ({duration}s)"))
+        except BaseException:
+            for task in render_tasks: task.cancel()
+            uploader.cancel()
+            raise
+        await upload_queue.put(None)
+        if not await uploader: raise ValueError("Failed to generate any media.")
         
+        status.cancel()
         await status_update_msg.delete()
 
         completion_text = "✅ <b>Task Complete!</b>\n\n🎬 Ready for another operation or close the session."
@@ -345,9 +814,10 @@ async def run_process_and_notify(client: Bot, user_id: int, screenshot_job=None,
 
     except Exception as e:
         error_text = f"❌ <b>An error occurred:</b>\n<code>{e}</code>"
+        if status: status.cancel()
         if status_update_msg: await status_update_msg.edit_text(error_text)
         else: await client.send_message(user_id, error_text)
     finally:
-        if 'cap' in locals() and cap is not None: cap.release()
-        for path in generated_media_paths:
-            if os.path.exists(path): os.remove(path)
+        session['jobs'] -= 1
+        session['last_active'] = time.time()
+        await asyncio.to_thread(_remove_files, generated_media_paths)